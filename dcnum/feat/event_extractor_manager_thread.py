@@ -1,5 +1,6 @@
 import logging
 import multiprocessing as mp
+import queue
 import threading
 import time
 from typing import Dict, List
@@ -16,6 +17,7 @@ class EventExtractorManagerThread(threading.Thread):
                  labels_list: List,
                  fe_kwargs: Dict,
                  num_workers: int,
+                 slot_event: threading.Event = None,
                  debug: bool = False,
                  *args, **kwargs):
         """Manage event extraction threads or precesses
@@ -34,11 +36,22 @@ class EventExtractorManagerThread(threading.Thread):
         slot_chunks:
             For each slot in `slot_states`, this shared array defines
             on which chunk in `image_data` the segmentation took place.
+        labels_list:
+            For each slot in `slot_states`, the labels of the chunk.
+            If this list was created with
+            :func:`.QueueEventExtractor.get_labels_list`, the labels
+            are already in shared memory and are not copied. Otherwise,
+            the labels are copied to the first chunk of the shared
+            `label_array` in `fe_kwargs`.
         fe_kwargs:
             Feature extraction keyword arguments. See
             :func:`.EventExtractor.get_init_kwargs` for more information.
         num_workers:
             Number of child threads or worker processes to use.
+        slot_event:
+            Event which the :class:`.SegmenterManagerThread` sets
+            when it hands over a slot (see its `slot_event` attribute).
+            If not set, `slot_states` is checked every 100 ms.
         debug:
             Whether to run in debugging mode which means more log
             messages and only one thread (`num_workers` has no effect).
@@ -61,14 +74,114 @@ class EventExtractorManagerThread(threading.Thread):
         self.raw_queue = self.fe_kwargs["raw_queue"]
         #: List of chunk labels corresponding to `slot_states`
         self.labels_list = labels_list
-        #: Shared labeling array
+        #: Shared labeling array (one chunk per slot)
         self.label_array = np.ctypeslib.as_array(
             self.fe_kwargs["label_array"]).reshape(
-            self.data.image.chunk_shape)
+            -1, *self.data.image.chunk_shape)
+        #: Shared array indicating which frames are duplicates
+        self.duplicate_frames = np.ctypeslib.as_array(
+            self.fe_kwargs["duplicate_frames"])
+        if len(self.labels_list) != len(self.slot_states):
+            raise ValueError(
+                f"`labels_list` must have one item for each of the "
+                f"{len(self.slot_states)} slots, got {len(labels_list)}!")
+        #: Whether the segmenter writes the labels directly to
+        #: `label_array` (one chunk per slot). Otherwise, the labels
+        #: are copied to the first chunk of `label_array`.
+        self.labels_shared = any(
+            labels is not None and np.may_share_memory(labels,
+                                                       self.label_array)
+            for labels in self.labels_list)
+        if (self.labels_shared
+                and len(self.label_array) != len(self.slot_states)):
+            raise ValueError(
+                f"The shared `label_array` has room for "
+                f"{len(self.label_array)} chunks, but there are "
+                f"{len(self.slot_states)} slots. Set `num_slots` in "
+                f"`QueueEventExtractor.get_init_kwargs` accordingly!")
         #: Time counter for feature extraction
         self.t_count = 0
         #: Whether debugging is enabled
         self.debug = debug
+        #: Last frame of each processed chunk for determining whether
+        #: the first frame of the next chunk is a duplicate
+        self.last_frames = {}
+        #: Event that is set when the segmenter hands over a slot
+        self.slot_event = slot_event or threading.Event()
+        #: Thread that joins `raw_queue` in :func:`wait_for_workers`
+        self.queue_joiner = None
+
+    def set_duplicate_frames(self, chunk):
+        """Determine which frames of a chunk are identical to the previous
+
+        The result is written to the shared `duplicate_frames` array
+        so that the workers do not have to compare the frames. The
+        first frame of a chunk is compared to the last frame of the
+        previous chunk, if that chunk was already processed. Otherwise,
+        the worker compares it.
+        """
+        image = self.data.image
+        image_chunk = image.get_chunk(chunk)
+        duplicates = np.zeros(len(image_chunk), dtype=np.int8)
+        for ii in range(1, len(image_chunk)):
+            duplicates[ii] = np.array_equal(image_chunk[ii],
+                                            image_chunk[ii - 1])
+        offset = chunk * image.chunk_size
+        if offset:
+            last_frame = self.last_frames.pop(chunk - 1, None)
+            if last_frame is None:
+                # not determined yet (see `QueueEventExtractor`)
+                duplicates[0] = -1
+            else:
+                duplicates[0] = np.array_equal(last_frame, image_chunk[0])
+        if chunk + 1 < image.num_chunks:
+            self.last_frames[chunk] = np.copy(image_chunk[-1])
+        self.duplicate_frames[offset:offset + len(image_chunk)] = duplicates
+
+    def wait_for_workers(self, workers):
+        """Wait until the workers processed everything in `raw_queue`
+
+        Raises a RuntimeError if one of the workers exited, because
+        then the queue might never be joined.
+        """
+        queue_joined = threading.Event()
+
+        def join_queue():
+            self.raw_queue.join()
+            queue_joined.set()
+
+        self.queue_joiner = threading.Thread(
+            target=join_queue,
+            name="EventExtractorManagerJoin",
+            daemon=True)
+        self.queue_joiner.start()
+        while not queue_joined.wait(timeout=.1):
+            dead = [w for w in workers if not w.is_alive()]
+            if dead:
+                self.logger.error(f"Extraction workers exited: {dead}")
+                raise RuntimeError(
+                    f"{len(dead)} extraction worker(s) exited before "
+                    f"processing all label images")
+
+    def stop_workers(self, workers):
+        """Tell the workers that there is nothing more coming and join them
+
+        Every worker stops when it gets `None` from `raw_queue`.
+        """
+        self.logger.debug("Requesting extraction workers to join.")
+        self.fe_kwargs["finalize_extraction"].value = True
+        for _ in workers:
+            self.raw_queue.put(None)
+        [w.join() for w in workers]
+        # If a worker exited early, there are items left in `raw_queue`.
+        # Mark them as done, so that the `queue_joiner` thread exits.
+        while self.queue_joiner is not None and self.queue_joiner.is_alive():
+            try:
+                self.raw_queue.get(timeout=.1)
+            except queue.Empty:
+                pass
+            else:
+                self.raw_queue.task_done()
 
     def run(self):
         # Initialize all workers
@@ -81,60 +194,74 @@ class EventExtractorManagerThread(threading.Thread):
         [w.start() for w in workers]
 
         chunks_processed = 0
-        while True:
-            num_slots = len(self.slot_states)
-            cur_slot = 0
-            unavailable_slots = 0
-            # Check all slots for segmented labels
+        try:
             while True:
-                # - "e" there is data from the segmenter (the extractor
-                #   can take it and process it)
-                # - "s" the extractor processed the data and is waiting
-                #   for the segmenter
-                if self.slot_states[cur_slot] == "e":
-                    break
-                else:
-                    unavailable_slots += 1
-                    cur_slot = (cur_slot + 1) % num_slots
-                if unavailable_slots >= num_slots:
-                    # There is nothing to do, try to avoid 100% CPU
-                    unavailable_slots = 0
-                    time.sleep(.1)
-
-            t1 = time.monotonic()
-
-            # We have a chunk, process it!
-            chunk = self.slot_chunks[cur_slot]
-            # Populate the labeling array for the workers
-            new_labels = self.labels_list[cur_slot]
-            if len(new_labels) == self.label_array.shape[0]:
-                self.label_array[:] = new_labels
-            elif len(new_labels) < self.label_array.shape[0]:
-                self.label_array[:len(new_labels)] = new_labels
-                self.label_array[len(new_labels):] = 0
-            else:
-                raise ValueError("labels_list contains bad size data!")
-            # Let the workers know there is work
-            for ii in range(self.data.image.get_chunk_size(chunk)):
-                self.raw_queue.put((chunk, ii))
+                num_slots = len(self.slot_states)
+                cur_slot = 0
+                unavailable_slots = 0
+                # Check all slots for segmented labels
+                while True:
+                    # - "e" there is data from the segmenter (the extractor
+                    #   can take it and process it)
+                    # - "s" the extractor processed the data and is waiting
+                    #   for the segmenter
+                    if self.slot_states[cur_slot] == "e":
+                        break
+                    else:
+                        unavailable_slots += 1
+                        cur_slot = (cur_slot + 1) % num_slots
+                    if unavailable_slots >= num_slots:
+                        # There is nothing to do, wait for the segmenter
+                        # (and check the slots again after a while).
+                        unavailable_slots = 0
+                        self.slot_event.wait(timeout=.1)
+                        self.slot_event.clear()
 
-            # Make sure the entire chunk has been processed.
-            while self.raw_queue.qsize():
-                time.sleep(.1)
+                t1 = time.monotonic()
 
-            # We are done here. The segmenter may continue its deed.
-            self.slot_states[cur_slot] = "w"
+                # We have a chunk, process it!
+                chunk = self.slot_chunks[cur_slot]
+                # Populate the labeling array for the workers. The chunks
+                # are processed one after another, so without shared
+                # labels, the first chunk of `label_array` is enough.
+                label_slot = cur_slot if self.labels_shared else 0
+                slot_array = self.label_array[label_slot]
+                new_labels = self.labels_list[cur_slot]
+                if np.may_share_memory(new_labels, slot_array):
+                    # The segmenter wrote the labels to shared memory.
+                    pass
+                elif len(new_labels) == slot_array.shape[0]:
+                    slot_array[:] = new_labels
+                elif len(new_labels) < slot_array.shape[0]:
+                    slot_array[:len(new_labels)] = new_labels
+                    slot_array[len(new_labels):] = 0
+                else:
+                    raise ValueError("labels_list contains bad size data!")
+                self.set_duplicate_frames(chunk)
+                # Let the workers know there is work. Instead of sending
+                # every label index individually, send ranges of label
+                # indices (a few per worker for load balancing).
+                chunk_size = self.data.image.get_chunk_size(chunk)
+                batch_size = max(1, chunk_size // (4 * self.num_workers))
+                for start in range(0, chunk_size, batch_size):
+                    stop = min(start + batch_size, chunk_size)
+                    self.raw_queue.put((chunk, label_slot, start, stop))
 
-            self.logger.debug(f"Extracted one chunk: {chunk}")
-            self.t_count += time.monotonic() - t1
+                # Make sure the entire chunk has been processed (the workers
+                # call `task_done` for every item they got from the queue).
+                self.wait_for_workers(workers)
 
-            chunks_processed += 1
+                # We are done here. The segmenter may continue its deed.
+                self.slot_states[cur_slot] = "w"
 
-            if chunks_processed == self.data.image.num_chunks:
-                break
+                self.logger.debug(f"Extracted one chunk: {chunk}")
+                self.t_count += time.monotonic() - t1
 
-        self.logger.debug("Requesting extraction workers to join.")
-        self.fe_kwargs["finalize_extraction"].value = True
-        [w.join() for w in workers]
+                chunks_processed += 1
+
+                if chunks_processed == self.data.image.num_chunks:
+                    break
+        finally:
+            self.stop_workers(workers)
         self.logger.debug("Finished extraction.")
         self.logger.info(f"Extraction time: {self.t_count:.1f}s")
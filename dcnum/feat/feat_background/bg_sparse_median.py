@@ -1,10 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 import logging
-import multiprocessing as mp
-import queue
-import time
 import uuid
 
+import h5py
 import hdf5plugin
+from numba import njit, uint8, void
 import numpy as np
 from scipy import ndimage
 
@@ -123,39 +123,29 @@ class BackgroundSparseMed(Background):
                                    self.image_shape[1]),
                                   dtype=np.uint8)
 
-        #: mp.RawArray for temporary batch input data
-        self.shared_input_raw = mp.RawArray(
-            np.ctypeslib.ctypes.c_uint8,
-            int(np.prod(self.image_shape)) * kernel_size)
-        #: mp.RawArray for the median background image
-        self.shared_output_raw = mp.RawArray(
-            np.ctypeslib.ctypes.c_uint8,
-            int(np.prod(self.image_shape)))
-        # Convert the RawArray to something we can write to fast
-        # (similar to memoryview, but without having to cast) using
-        # np.ctypeslib.as_array. See discussion in
-        # https://stackoverflow.com/questions/37705974
-        #: numpy array reshaped view on `self.shared_input_raw` with
-        #: first axis enumerating the events
-        self.shared_input = np.ctypeslib.as_array(
-            self.shared_input_raw).reshape(kernel_size, -1)
-        self.shared_output = np.ctypeslib.as_array(
-            self.shared_output_raw).reshape(self.image_shape)
-        #: multiprocessing pool for parallel processing
-        self.pool = mp.Pool(processes=self.num_cpus)
-
-        #: counter tracking process of workers
-        self.worker_counter = mp.Value("l", 0)
-        #: queue for median computation jobs
-        self.queue = mp.Queue()
-        #: list of workers (processes)
-        self.workers = [MedianWorkerSingle(self.queue,
-                                           self.worker_counter,
-                                           self.shared_input_raw,
-                                           self.shared_output_raw,
-                                           self.kernel_size)
-                        for _ in range(self.num_cpus)]
-        [w.start() for w in self.workers]
+        #: input data array for median computation (shared by the worker
+        #: threads) with the first axis enumerating the events
+        self.shared_input = np.empty(
+            (kernel_size, int(np.prod(self.image_shape))), dtype=np.uint8)
+        #: output array for the median background image
+        self.shared_output = np.empty(self.image_shape, dtype=np.uint8)
+        #: range of events currently stored in `self.shared_input`
+        #: (event `idx` is stored at position `idx % kernel_size`)
+        self.shared_input_range = (0, 0)
+        #: thread pool for parallel median computation (the median
+        #: kernel releases the GIL)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.num_cpus,
+            thread_name_prefix="BackgroundSparseMed")
+        #: pixel slices of the images, one for each worker thread (the
+        #: computational cost of the median is the same for all pixels)
+        self.job_slices = []
+        num_pixels = self.shared_input.shape[1]
+        for jj in range(self.num_cpus):
+            start = num_pixels * jj // self.num_cpus
+            stop = num_pixels * (jj + 1) // self.num_cpus
+            if stop > start:
+                self.job_slices.append(slice(start, stop))
 
         # Initialize background data
         if compress:
@@ -178,15 +168,13 @@ class BackgroundSparseMed(Background):
         return self
 
     def __exit__(self, type, value, tb):
+        # Stop the worker threads before closing the files
+        self.executor.shutdown(wait=True, cancel_futures=True)
         # Close h5in and h5out
         if self.h5in is not None:
             self.h5in.close()
         if self.h5in is not self.h5out and self.h5out is not None:
             self.h5out.close()
-        self.worker_counter.value = -1000
-        [w.join() for w in self.workers]
-        self.pool.terminate()
-        self.pool.join()
 
     @staticmethod
     def check_user_kwargs(*,
@@ -242,7 +230,7 @@ class BackgroundSparseMed(Background):
             # effect.
             # For each of those images, compute the ptp profile (ptp along the
             # channel axis)
-            bg_prof = np.ptp(self.bg_images, axis=2)
+            bg_prof = ptp_uint8_rows(self.bg_images)
             # compute the median of those profiles along the channel axis
             bg_prof_med = np.median(bg_prof, axis=0)
             # normalize the profiles
@@ -267,12 +255,17 @@ class BackgroundSparseMed(Background):
 
             ref = np.abs(x - np.median(x))
             thresh_fact = np.var(ref) * 150
+            # Threshold below which `frac_cleansing` of the backgrounds are
+            # kept. `np.quantile` would interpolate between the k-th and
+            # the (k+1)-th smallest value, but that does not change the
+            # selection `ref <= thresh`, so we only partition around k.
+            k_cleansing = int(self.frac_cleansing * (ref.size - 1))
             if self.thresh_cleansing != 0:
                 # Try a simple thresholding approach.
                 thresh = thresh_fact / self.thresh_cleansing
             else:
                 # Force a certain quantile fraction to be removed
-                thresh = np.quantile(ref, self.frac_cleansing)
+                thresh = np.partition(ref, k_cleansing)[k_cleansing]
             used = ref <= thresh
             frac_remove = np.sum(~used) / used.size
 
@@ -282,7 +275,7 @@ class BackgroundSparseMed(Background):
                 # This did not work at all.
                 # use quantiles instead
                 frac_remove_user = frac_remove
-                thresh = np.quantile(ref, self.frac_cleansing)
+                thresh = np.partition(ref, k_cleansing)[k_cleansing]
                 used = ref <= thresh
                 frac_remove = np.sum(~used) / used.size
                 logger.warning(
@@ -301,15 +294,7 @@ class BackgroundSparseMed(Background):
             bg_images = self.bg_images
 
         # Assign each frame to a certain background index
-        bg_idx = np.zeros(self.event_count, dtype=int)
-        idx0 = 0
-        for ii in range(len(step_times)):
-            t1 = step_times[ii]
-            idx1 = np.argmin(np.abs(self.time - t1 + self.split_time/2))
-            bg_idx[idx0:idx1] = ii
-            idx0 = idx1
-        # Fill up remainder of index array with last entry
-        bg_idx[idx1:] = ii
+        bg_idx = self.get_background_indices(step_times)
 
         # Write background data
         pos = 0
@@ -321,90 +306,171 @@ class BackgroundSparseMed(Background):
                 bg_images[bg_idx[cur_slice]]
             pos += step
 
-    def process_second(self, ii, second):
-        idx_start = np.argmin(np.abs(second - self.time))
+    def get_background_indices(self, step_times):
+        """Return the index in `step_times` for each event
+
+        Each event gets the background image whose time is closest,
+        i.e. the events are split at the frames closest to the times
+        halfway between `step_times` (requires `self.time` to be sorted).
+        """
+        # Indices of the frames closest to `step_times - split_time/2`
+        # (for equal distance, use the first frame).
+        bounds = np.searchsorted(self.time,
+                                 step_times - self.split_time / 2)
+        left = np.maximum(bounds - 1, 0)
+        right = np.minimum(bounds, self.event_count - 1)
+        dist_left = np.abs(self.time[left] - step_times + self.split_time/2)
+        dist_right = np.abs(
+            self.time[right] - step_times + self.split_time/2)
+        use_left = dist_left <= dist_right
+        # first frame with the same time as the left candidate
+        left = np.searchsorted(self.time, self.time[left])
+        idx_split = np.where(use_left, left, right)
+        # Events before the first split index get the first background
+        # and events after the last split index get the last background.
+        bg_idx = np.searchsorted(idx_split,
+                                 np.arange(self.event_count),
+                                 side="right")
+        return np.minimum(bg_idx, len(step_times) - 1)
+
+    def get_window(self, idx_start, idx_stop):
+        """Return the input data of the given events as a 2d array
+
+        The first axis of the returned array enumerates the events
+        (in no particular order) and the second axis the pixels.
+        If the input data is a uint8 numpy array, a view is returned.
+        Otherwise, the events are loaded into `self.shared_input`.
+        Events that are already there from the previous call
+        are not loaded again.
+        """
+        data = self.input_data
+        if (isinstance(data, np.ndarray) and data.dtype == np.uint8
+                and data.flags.c_contiguous):
+            return data[idx_start:idx_stop].reshape(self.kernel_size, -1)
+
+        ksize = self.kernel_size
+        prev_start, prev_stop = self.shared_input_range
+        # Ranges of events that have to be loaded
+        if prev_stop <= idx_start or idx_stop <= prev_start:
+            new_ranges = [(idx_start, idx_stop)]
+        else:
+            new_ranges = [(idx_start, min(idx_stop, prev_start)),
+                          (max(idx_start, prev_stop), idx_stop)]
+        dest = self.shared_input.reshape(ksize, *self.image_shape)
+        for start, stop in new_ranges:
+            while start < stop:
+                # position in the shared array (wrap around at the end)
+                pos = start % ksize
+                size = min(stop - start, ksize - pos)
+                if isinstance(data, h5py.Dataset):
+                    data.read_direct(dest,
+                                     source_sel=np.s_[start:start + size],
+                                     dest_sel=np.s_[pos:pos + size])
+                else:
+                    dest[pos:pos + size] = data[start:start + size]
+                start += size
+        self.shared_input_range = (idx_start, idx_stop)
+        return self.shared_input
+
+    def get_window_range(self, second):
+        """Return the range of events used for the background at `second`
+
+        The window starts at the event whose time is closest to `second`
+        (requires `self.time` to be sorted).
+        """
+        # Equivalent to `np.argmin(np.abs(second - self.time))`, but
+        # with a binary search instead of a pass over all events.
+        right = min(np.searchsorted(self.time, second), self.event_count - 1)
+        left = max(right - 1, 0)
+        dist_left = np.abs(second - self.time[left])
+        dist_right = np.abs(second - self.time[right])
+        idx_start = left if dist_left <= dist_right else right
+        # For equal times, use the first event.
+        idx_start = int(np.searchsorted(self.time, self.time[idx_start]))
         idx_stop = idx_start + self.kernel_size
         if idx_stop >= self.event_count:
             diff = idx_stop - self.event_count
             idx_stop -= diff
             idx_start -= diff
             assert idx_start >= 0
+        return idx_start, idx_stop
+
+    def process_second(self, ii, second):
+        idx_start, idx_stop = self.get_window_range(second)
 
         # The following is equivalent to, but faster than:
         # self.bg_images[ii] = np.median(self.input_data[idx_start:idx_stop],
         #                                axis=0)
 
-        self.worker_counter.value = 0
-        self.shared_input[:] = self.input_data[idx_start:idx_stop].reshape(
-            self.kernel_size, -1)
-
-        self.worker_counter.value = 0
-
-        num_jobs = 0
-        # Cut the image into jobs with ival=500 pixels which seems
-        # optimal on Paul's laptop.
-        height, width = self.image_shape
-        start = 0
-        ival = 500
-        smax = height * width
-        while start < smax:
-            args = (slice(start, start+ival),)
-            start += ival
-            self.queue.put(args)
-            num_jobs += 1
-
-        # block until workers are done
-        while True:
-            time.sleep(.01)
-            if self.worker_counter.value == num_jobs:
-                break
+        window = self.get_window(idx_start, idx_stop)
 
-        self.bg_images[ii] = self.shared_output.reshape(self.image_shape)
+        # Compute the median of each subslice of the array in the
+        # thread pool and block until all jobs are done.
+        shared_output = self.shared_output.reshape(-1)
+        list(self.executor.map(
+            lambda job_slice: median_uint8_columns(
+                window[:, job_slice],
+                shared_output[job_slice]),
+            self.job_slices))
 
+        self.bg_images[ii] = self.shared_output.reshape(self.image_shape)
 
-class MedianWorkerSingle(mp.Process):
-    def __init__(self, job_queue, counter, shared_input, shared_output,
-                 kernel_size, *args, **kwargs):
-        """Worker process for median computation"""
-        super(MedianWorkerSingle, self).__init__(*args, **kwargs)
-        self.queue = job_queue
-        self.queue.cancel_join_thread()
-        self.counter = counter
-        self.shared_input_raw = shared_input
-        self.shared_output_raw = shared_output
-        self.kernel_size = kernel_size
 
-    def run(self):
-        """Main loop of worker process (breaks when `self.counter` <0)"""
-        # Create the ctypes arrays here instead of during __init__, because
-        # for some reason they are copied in __init__ and not mapped.
-        shared_input = np.ctypeslib.as_array(
-            self.shared_input_raw).reshape(self.kernel_size, -1)
-        shared_output = np.ctypeslib.as_array(self.shared_output_raw)
-        while True:
-            if self.counter.value < 0:
+@njit(void(uint8[:, :], uint8[:]), cache=True, nogil=True)
+def median_uint8_columns(data, out):
+    """Compute the median along the first axis of a uint8 array
+
+    For each column, a histogram of the 256 grayscale values is
+    computed from which the median is obtained. This is equivalent to
+    `np.partition(data, kth, axis=0)[kth]` with `kth = len(data) // 2`,
+    i.e. for an even number of rows, the upper of the two central
+    values is used.
+
+    Parameters
+    ----------
+    data: 2d uint8 ndarray
+        Input data; The median is computed along the first axis.
+    out: 1d uint8 ndarray
+        Output array with one element for each column in `data`
+
+    Notes
+    -----
+    The GIL is released during computation, so this function can be
+    called concurrently from several threads for different columns.
+    Note that we only take the value at `kth`, regardless of the input
+    size. This is ok, because we are only interested in integers anyway
+    and +/- one grayscale value does not really matter.
+    """
+    size, num_cols = data.shape
+    kth = size // 2
+    hist = np.zeros(256, dtype=np.int32)
+    for jj in range(num_cols):
+        hist[:] = 0
+        for ii in range(size):
+            hist[data[ii, jj]] += 1
+        count = 0
+        for vv in range(256):
+            count += hist[vv]
+            if count > kth:
+                out[jj] = vv
                 break
-            try:
-                args = self.queue.get(timeout=.1)
-            except queue.Empty:
-                pass
-            else:
-                job_slice = args[0]
-                # Compute the median of a subslice of the array.
-                # Use np.partition which has less overhead than np.median
-                # (code copy-pasted from np.median):
-                kth = shared_input.shape[0] // 2
-                part = np.partition(a=shared_input[:, job_slice],
-                                    kth=kth,
-                                    axis=0)
-                # Note that we only partition at `kth`, regardless of the
-                # input size. This is ok, because we are only interested
-                # in integers anyway and +/- one grayscale value does not
-                # really matter.
-                shared_output[job_slice] = part[kth]
-                # shared_output[job_slice] = np.median(
-                #     shared_input[:, job_slice],
-                #     axis=0,
-                #     overwrite_input=False)
-                with self.counter.get_lock():
-                    self.counter.value += 1
+
+
+@njit(uint8[:, :](uint8[:, :, :]), cache=True)
+def ptp_uint8_rows(images):
+    """Compute the peak-to-peak value along the last axis of an image stack
+
+    This is equivalent to `np.ptp(images, axis=2)`, but the minimum
+    and the maximum are computed in one pass.
+    """
+    size, height, width = images.shape
+    ptp = np.zeros((size, height), dtype=np.uint8)
+    for ii in range(size):
+        for jj in range(height):
+            vmin = images[ii, jj, 0]
+            vmax = vmin
+            for kk in range(1, width):
+                vmin = min(vmin, images[ii, jj, kk])
+                vmax = max(vmax, images[ii, jj, kk])
+            ptp[ii, jj] = vmax - vmin
+    return ptp
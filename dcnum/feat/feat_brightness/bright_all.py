@@ -8,17 +8,14 @@ def brightness_features(image,
                         mask,
                         image_bg=None,
                         image_corr=None):
-    mask = np.array(mask, dtype=bool)
+    # make sure we have a boolean array (without copying)
+    mask = np.asarray(mask, dtype=bool)
     size = mask.shape[0]
 
     br_dict = {}
     for key in brightness_names:
         br_dict[key] = np.full(size, np.nan, dtype=np.float64)
 
-    avg_sd = compute_avg_sd_masked_uint8(image, mask)
-    br_dict["bright_avg"][:] = avg_sd[:, 0]
-    br_dict["bright_sd"][:] = avg_sd[:, 1]
-
     if image_bg is not None:
         br_dict["bg_med"][:] = compute_median(image_bg)
 
@@ -27,44 +24,67 @@ def brightness_features(image,
         if image_corr is None:
             image_corr = np.array(image, dtype=np.int16) - image_bg
 
-        avg_sd_corr = compute_avg_sd_masked_int16(image_corr, mask)
-        br_dict["bright_bc_avg"][:] = avg_sd_corr[:, 0]
-        br_dict["bright_bc_sd"][:] = avg_sd_corr[:, 1]
-
-        # Percentiles
-        percentiles = compute_percentiles_10_90(image_corr, mask)
-        br_dict["bright_perc_10"][:] = percentiles[:, 0]
-        br_dict["bright_perc_90"][:] = percentiles[:, 1]
+        # Compute all masked values in one pass over each mask
+        bright = compute_brightness_masked(
+            image, np.asarray(image_corr, dtype=np.int16), mask)
+        br_dict["bright_avg"][:] = bright[:, 0]
+        br_dict["bright_sd"][:] = bright[:, 1]
+        br_dict["bright_bc_avg"][:] = bright[:, 2]
+        br_dict["bright_bc_sd"][:] = bright[:, 3]
+        br_dict["bright_perc_10"][:] = bright[:, 4]
+        br_dict["bright_perc_90"][:] = bright[:, 5]
+    else:
+        avg_sd = compute_avg_sd_masked_uint8(image, mask)
+        br_dict["bright_avg"][:] = avg_sd[:, 0]
+        br_dict["bright_sd"][:] = avg_sd[:, 1]
 
     return br_dict
 
 
-@njit(float64[:, :](uint8[:, :, :], bool_[:, :, :]), cache=True)
-def compute_avg_sd_masked_uint8(image, mask):
+@njit(float64[:, :](uint8[:, :, :], int16[:, :, :], bool_[:, :, :]),
+      cache=True)
+def compute_brightness_masked(image, image_corr, mask):
+    """Compute the masked brightness values of `image` and `image_corr`
+
+    The pixel indices of each mask are determined only once. Returns
+    an array with the columns mean and standard deviation of `image`,
+    mean and standard deviation of `image_corr`, and 10th and 90th
+    percentile of `image_corr`.
+    """
     size = mask.shape[0]
-    avg_sd = np.zeros((size, 2), dtype=np.float64)
+    bright = np.zeros((size, 6), dtype=np.float64)
     for ii in prange(size):
         maski = np.where(mask[ii].ravel())[0]
         if image.shape[0] == 1:
             image_idx = 0
         else:
             image_idx = ii
+        if image_corr.shape[0] == 1:
+            corr_idx = 0
+        else:
+            corr_idx = ii
         masked = image[image_idx].ravel()[maski]
-        avg_sd[ii, 0] = np.mean(masked)
-        avg_sd[ii, 1] = np.std(masked)
-    return avg_sd
+        bright[ii, 0] = np.mean(masked)
+        bright[ii, 1] = np.std(masked)
+        masked_corr = image_corr[corr_idx].ravel()[maski]
+        bright[ii, 2] = np.mean(masked_corr)
+        bright[ii, 3] = np.std(masked_corr)
+        peri = np.percentile(masked_corr, q=(10, 90))
+        bright[ii, 4] = peri[0]
+        bright[ii, 5] = peri[1]
+    return bright
 
 
-@njit(float64[:, :](int16[:, :, :], bool_[:, :, :]), cache=True)
-def compute_avg_sd_masked_int16(image, mask):
+@njit(float64[:, :](uint8[:, :, :], bool_[:, :, :]), cache=True)
+def compute_avg_sd_masked_uint8(image, mask):
     size = mask.shape[0]
     avg_sd = np.zeros((size, 2), dtype=np.float64)
     for ii in prange(size):
+        maski = np.where(mask[ii].ravel())[0]
         if image.shape[0] == 1:
             image_idx = 0
         else:
             image_idx = ii
-        maski = np.where(mask[ii].ravel())[0]
         masked = image[image_idx].ravel()[maski]
         avg_sd[ii, 0] = np.mean(masked)
         avg_sd[ii, 1] = np.std(masked)
@@ -78,20 +98,3 @@ def compute_median(image):
     for ii in prange(size):
         image_med[ii] = np.median(image[ii].ravel())
     return image_med
-
-
-@njit(float64[:, :](int16[:, :, :], bool_[:, :, :]), cache=True)
-def compute_percentiles_10_90(image, mask):
-    size = mask.shape[0]
-    percentiles = np.zeros((size, 2), dtype=np.float64)
-    for ii in prange(size):
-        maski = np.where(mask[ii].ravel())[0]
-        if image.shape[0] == 1:
-            image_idx = 0
-        else:
-            image_idx = ii
-        masked = image[image_idx].ravel()[maski]
-        peri = np.percentile(masked, q=(10, 90))
-        percentiles[ii, 0] = peri[0]
-        percentiles[ii, 1] = peri[1]
-    return percentiles
@@ -1,13 +1,61 @@
-from mahotas.features import haralick as mh_haralick
+from numba import njit, prange, bool_, float64, int16, int32, uint8, void
 import numpy as np
 
 from .common import haralick_names
 
 
+#: Column in the output of :func:`compute_haralick_features`
+#: for each feature in `haralick_names`. Columns 0 to 12 contain the
+#: mean and columns 13 to 25 the peak-to-peak values of the features.
+haralick_columns = {
+    # (1) Angular Second Moment
+    "tex_asm_avg": 0,
+    "tex_asm_ptp": 13,
+    # (2) Contrast
+    "tex_con_avg": 1,
+    "tex_con_ptp": 14,
+    # (3) Correlation
+    "tex_cor_avg": 2,
+    "tex_cor_ptp": 15,
+    # (4) Variance
+    "tex_var_avg": 3,
+    "tex_var_ptp": 16,
+    # (5) Inverse Difference Moment
+    "tex_idm_avg": 4,
+    "tex_idm_ptp": 17,
+    # (6) Feature 6 "Sum Average", which is equivalent to
+    # 2 * bright_bc_avg since dclab 0.44.0.
+    # (7) Sum Variance
+    "tex_sva_avg": 6,
+    "tex_sva_ptp": 19,
+    # (8) Sum Entropy
+    "tex_sen_avg": 7,
+    "tex_sen_ptp": 20,
+    # (9) Entropy
+    "tex_ent_avg": 8,
+    "tex_ent_ptp": 21,
+    # (10) Feature 10 "Difference Variance" is excluded, because it
+    # has a functional dependency on the offset value (we use "1" here)
+    # and thus is not really only describing texture.
+    # (11) Difference Entropy
+    "tex_den_avg": 10,
+    "tex_den_ptp": 23,
+    # (12) Information Measure of Correlation 1
+    "tex_f12_avg": 11,
+    "tex_f12_ptp": 24,
+    # (13) Information Measure of Correlation 2
+    "tex_f13_avg": 12,
+    "tex_f13_ptp": 25,
+    # (14) Feature 14 is excluded, because nobody is using it, it is
+    # not understood by everyone what it actually is, and it is
+    # computationally expensive.
+}
+
+
 def haralick_texture_features(
         mask, image=None, image_bg=None, image_corr=None):
     # make sure we have a boolean array
-    mask = np.array(mask, dtype=bool)
+    mask = np.asarray(mask, dtype=bool)
     size = mask.shape[0]
 
     # compute features if necessary
@@ -15,84 +63,193 @@ def haralick_texture_features(
         # Background-corrected brightness values
         image_corr = np.array(image, dtype=np.int16) - image_bg
 
+    # Haralick texture features
+    # https://gitlab.gwdg.de/blood_data_analysis/dcevent/-/issues/20
+    # Preprocessing (done for each event in `compute_haralick_features`
+    # on the bounding box of the mask):
+    # - create a copy of the array (don't edit `image_corr`)
+    # - add grayscale values (negative values not supported)
+    #   -> maximum value should be as small as possible
+    # - set pixels outside contour to zero (ignored areas)
+    # - `image_corr` may contain only one image for all masks
+    image_corr = np.asarray(image_corr, dtype=np.int16)
+    # Fortran order, so that the feature columns are contiguous
+    ret = np.full((size, 26), np.nan, dtype=np.float64, order="F")
+    compute_haralick_features(mask, image_corr, ret)
+
     tex_dict = {}
-    empty = np.full(size, np.nan, dtype=np.float64)
     for key in haralick_names:
-        tex_dict[key] = np.copy(empty)
-
-    for ii in range(size):
-        # Haralick texture features
-        # https://gitlab.gwdg.de/blood_data_analysis/dcevent/-/issues/20
-        # Preprocessing:
-        # - create a copy of the array (don't edit `image_corr`)
-        # - add grayscale values (negative values not supported)
-        #   -> maximum value should be as small as possible
-        # - set pixels outside contour to zero (ignored areas, see mahotas)
-        maski = mask[ii]
-        if not np.any(maski):
-            # The mask is empty (nan values)
+        tex_dict[key] = ret[:, haralick_columns[key]]
+
+    return tex_dict
+
+
+@njit(float64(float64[:]), cache=True)
+def entropy(p):
+    """Return the entropy (base 2) of a probability distribution"""
+    pnz = p[p > 0]
+    return -np.sum(pnz * np.log2(pnz))
+
+
+@njit(void(int32[:, :], float64[:]), cache=True)
+def compute_haralick_features_glcm(glcm, feats):
+    """Compute the first 13 Haralick features from a co-occurrence matrix
+
+    The features are computed like in `mahotas.features.haralick_features`.
+    """
+    ng = glcm.shape[0]
+    p = glcm / glcm.sum()
+    pravel = p.ravel()
+
+    k = np.arange(ng) * 1.
+    idx_i = np.arange(ng).reshape(ng, 1)
+    idx_j = np.arange(ng).reshape(1, ng)
+
+    px = p.sum(axis=0)
+    py = p.sum(axis=1)
+    ux = np.sum(px * k)
+    uy = np.sum(py * k)
+    vx = np.sum(px * k**2) - ux**2
+    vy = np.sum(py * k**2) - uy**2
+    sx = np.sqrt(vx)
+    sy = np.sqrt(vy)
+
+    # probabilities of the sums and absolute differences of gray levels
+    idx_plus = (idx_i + idx_j).ravel()
+    idx_minus = np.abs(idx_i - idx_j).ravel()
+    px_plus_y = np.bincount(idx_plus, pravel)
+    px_minus_y = np.bincount(idx_minus, pravel)
+    tk = np.arange(px_plus_y.size) * 1.
+
+    # (1) Angular Second Moment
+    feats[0] = np.sum(pravel * pravel)
+    # (2) Contrast
+    feats[1] = np.sum(k**2 * px_minus_y)
+    # (3) Correlation
+    if sx == 0. or sy == 0.:
+        feats[2] = 1.
+    else:
+        feats[2] = (np.sum(idx_i * idx_j * p) - ux * uy) / sx / sy
+    # (4) Variance
+    feats[3] = vx
+    # (5) Inverse Difference Moment
+    feats[4] = np.sum(p / (1. + (idx_i - idx_j)**2))
+    # (6) Sum Average
+    feats[5] = np.sum(tk * px_plus_y)
+    # (7) Sum Variance
+    feats[6] = np.sum(tk**2 * px_plus_y) - feats[5]**2
+    # (8) Sum Entropy
+    feats[7] = entropy(px_plus_y)
+    # (9) Entropy
+    feats[8] = entropy(pravel)
+    # (10) Difference Variance
+    feats[9] = np.var(px_minus_y)
+    # (11) Difference Entropy
+    feats[10] = entropy(px_minus_y)
+    # (12) Information Measure of Correlation 1
+    hx = entropy(px)
+    hy = entropy(py)
+    crosspxpy = (px.reshape(ng, 1) * py.reshape(1, ng)).ravel()
+    nonzero = pravel > 0
+    hxy1 = -np.sum(pravel[nonzero] * np.log2(crosspxpy[nonzero]))
+    if max(hx, hy) == 0.:
+        feats[11] = feats[8] - hxy1
+    else:
+        feats[11] = (feats[8] - hxy1) / max(hx, hy)
+    # (13) Information Measure of Correlation 2
+    hxy2 = entropy(crosspxpy)
+    feats[12] = np.sqrt(max(0., 1. - np.exp(-2. * (hxy2 - feats[8]))))
+
+
+@njit(void(uint8[:, :], float64[:]), cache=True)
+def compute_haralick_features_image(imi, features):
+    """Compute the Haralick texture features for one preprocessed image
+
+    Four symmetric co-occurrence matrices (horizontal, vertical and
+    both diagonals, distance one) are built, ignoring all zero-valued
+    pixels. From each matrix, the first 13 Haralick features are
+    computed and the mean and the peak-to-peak value over the four
+    directions are written to `features` (array of length 26). If the
+    co-occurrence matrix of one of the directions is empty (e.g. if the
+    mask is a one-pixel horizontal line), then `features` is not modified.
+    """
+    height, width = imi.shape
+    # row and column offsets of the four directions
+    drow = np.array([0, 1, 1, 1])
+    dcol = np.array([1, 1, 0, -1])
+    # The size of the co-occurrence matrix does not have any
+    # effect on the features we use, so keep it small.
+    ng = int(imi.max()) + 1
+    glcm = np.zeros((ng, ng), dtype=np.int32)
+    # Only visit the pixels that are not ignored.
+    rows, cols = np.nonzero(imi)
+    feats = np.zeros((4, 13), dtype=np.float64)
+    for dd in range(4):
+        glcm[:] = 0
+        for pp in range(rows.size):
+            y2 = rows[pp] + drow[dd]
+            x2 = cols[pp] + dcol[dd]
+            if y2 < height and 0 <= x2 < width:
+                vb = imi[y2, x2]
+                if vb != 0:
+                    va = imi[rows[pp], cols[pp]]
+                    glcm[va, vb] += 1
+                    glcm[vb, va] += 1
+        if glcm.sum() == 0:
+            # We cannot compute features for an empty matrix.
+            return
+        compute_haralick_features_glcm(glcm, feats[dd])
+
+    for kk in range(13):
+        features[kk] = np.mean(feats[:, kk])
+        features[13 + kk] = np.max(feats[:, kk]) - np.min(feats[:, kk])
+
+
+@njit(void(bool_[:, :, :], int16[:, :, :], float64[:, :]),
+      cache=True, nogil=True)
+def compute_haralick_features(mask, image_corr, features):
+    """Compute the Haralick texture features for a stack of events
+
+    This is equivalent to calling `mahotas.features.haralick` with
+    `ignore_zeros=True` and `return_mean_ptp=True` for every
+    preprocessed event image (see :func:`haralick_texture_features`).
+    Since the features are translation-invariant, only the bounding
+    box of each mask is preprocessed and analyzed.
+
+    Parameters
+    ----------
+    mask: 3d boolean ndarray
+        Event masks
+    image_corr: 3d int16 ndarray
+        Background-corrected images; Either one image per mask or
+        one image for all masks
+    features: 2d float64 ndarray
+        Output array of shape `(len(mask), 26)`; The first 13 columns
+        contain the mean and the last 13 columns contain the peak-to-peak
+        values (see :func:`compute_haralick_features_image`).
+
+    Notes
+    -----
+    The GIL is released during computation, so this function can be
+    called concurrently from several threads (e.g. on slices of
+    `mask`, `image_corr` and `features`).
+    """
+    size = mask.shape[0]
+    for ii in prange(size):
+        rows, cols = np.nonzero(mask[ii])
+        if rows.size == 0:
             continue
+        # bounding box of the mask
+        r0 = rows.min()
+        r1 = rows.max() + 1
+        c0 = cols.min()
+        c1 = cols.max() + 1
+        mi = mask[ii, r0:r1, c0:c1]
         if image_corr.shape[0] == 1:
-            # We have several masks for one image.
-            imcoi = image_corr[0]
+            ici = image_corr[0, r0:r1, c0:c1].astype(np.int64)
         else:
-            imcoi = image_corr[ii]
-        minval = imcoi[maski].min()
-        imi = np.array((imcoi - minval + 1) * maski, dtype=np.uint8)
-        try:
-            ret = mh_haralick(imi,
-                              ignore_zeros=True,
-                              return_mean_ptp=True)
-        except ValueError:
-            # The error message looks like this:
-            #    ValueError: mahotas.haralick_features: the input is empty.
-            #    Cannot compute features! This can happen if you are
-            #    using `ignore_zeros`.
-            # The problem is that a co-occurrence matrix is all-zero (e.g.
-            # if the mask is just a one-pixel horizontal line, then the
-            # diagonal and vertical co-occurrence matrices do not have any
-            # entries. We just catch the exception and keep the `nan`s.
-            continue
-        # (1) Angular Second Moment
-        tex_dict["tex_asm_avg"][ii] = ret[0]
-        tex_dict["tex_asm_ptp"][ii] = ret[13]
-        # (2) Contrast
-        tex_dict["tex_con_avg"][ii] = ret[1]
-        tex_dict["tex_con_ptp"][ii] = ret[14]
-        # (3) Correlation
-        tex_dict["tex_cor_avg"][ii] = ret[2]
-        tex_dict["tex_cor_ptp"][ii] = ret[15]
-        # (4) Variance
-        tex_dict["tex_var_avg"][ii] = ret[3]
-        tex_dict["tex_var_ptp"][ii] = ret[16]
-        # (5) Inverse Difference Moment
-        tex_dict["tex_idm_avg"][ii] = ret[4]
-        tex_dict["tex_idm_ptp"][ii] = ret[17]
-        # (6) Feature 6 "Sum Average", which is equivalent to
-        # 2 * bright_bc_avg since dclab 0.44.0.
-        # (7) Sum Variance
-        tex_dict["tex_sva_avg"][ii] = ret[6]
-        tex_dict["tex_sva_ptp"][ii] = ret[19]
-        # (8) Sum Entropy
-        tex_dict["tex_sen_avg"][ii] = ret[7]
-        tex_dict["tex_sen_ptp"][ii] = ret[20]
-        # (9) Entropy
-        tex_dict["tex_ent_avg"][ii] = ret[8]
-        tex_dict["tex_ent_ptp"][ii] = ret[21]
-        # (10) Feature 10 "Difference Variance" is excluded, because it
-        # has a functional dependency on the offset value (we use "1" here)
-        # and thus is not really only describing texture.
-        # (11) Difference Entropy
-        tex_dict["tex_den_avg"][ii] = ret[10]
-        tex_dict["tex_den_ptp"][ii] = ret[23]
-        # (12) Information Measure of Correlation 1
-        tex_dict["tex_f12_avg"][ii] = ret[11]
-        tex_dict["tex_f12_ptp"][ii] = ret[24]
-        # (13) Information Measure of Correlation 2
-        tex_dict["tex_f13_avg"][ii] = ret[12]
-        tex_dict["tex_f13_ptp"][ii] = ret[25]
-        # (14) Feature 14 is excluded, because nobody is using it, it is
-        # not understood by everyone what it actually is, and it is
-        # computationally expensive.
-
-    return tex_dict
+            ici = image_corr[ii, r0:r1, c0:c1].astype(np.int64)
+        minval = ici.ravel()[mi.ravel()].min()
+        # Values that do not fit into uint8 wrap around.
+        imi = np.where(mi, ici - minval + 1, 0).astype(np.uint8)
+        compute_haralick_features_image(imi, features[ii])
@@ -146,13 +146,12 @@ class Gate:
     def gate_events(self, events):
         """Return boolean array with events that should be used"""
         if self.box_gates and bool(events):
-            key0 = list(events.keys())[0]
-            size = len(events[key0])
+            size = len(next(iter(events.values())))
             valid = np.ones(size, dtype=bool)
             for feat in self.features:
-                valid = np.logical_and(valid,
-                                       self.gate_feature(feat, events[feat])
-                                       )
+                np.logical_and(valid,
+                               self.gate_feature(feat, events[feat]),
+                               out=valid)
         else:
             raise ValueError("Empty events provided!")
         return valid
@@ -169,4 +168,14 @@ class Gate:
         """
         if mask_sum is None:
             mask_sum = np.sum(mask)
-        return mask_sum > self.kwargs["size_thresh_mask"]
+        return self.gate_mask_sums(mask_sum)
+
+    def gate_mask_sums(self, mask_sums):
+        """Return boolean array with the masks that should be used
+
+        Parameters
+        ----------
+        mask_sums: int or 1d ndarray
+            The sums of the boolean mask images of the events.
+        """
+        return mask_sums > self.kwargs["size_thresh_mask"]
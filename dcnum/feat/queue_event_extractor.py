@@ -3,7 +3,6 @@ import logging
 from logging.handlers import QueueHandler
 import multiprocessing as mp
 import os
-import queue
 import threading
 import traceback
 
@@ -24,11 +23,12 @@ class QueueEventExtractor:
                  gate: Gate,
                  preselect: bool,
                  ptp_median: float,
-                 raw_queue: mp.Queue,
+                 raw_queue: mp.JoinableQueue,
                  event_queue: mp.Queue,
                  log_queue: mp.Queue,
                  feat_nevents: mp.Array,
                  label_array: mp.Array,
+                 duplicate_frames: mp.Array,
                  finalize_extraction: mp.Value,
                  extract_kwargs: dict = None,
                  *args, **kwargs):
@@ -49,11 +49,14 @@ class QueueEventExtractor:
         ptp_median:
             Median peak-to-peak value in the images for preselction.
         raw_queue:
-            Queue from which the worker obtains the chunks and
-            indices of the labels to work on.
+            Joinable queue from which the worker obtains the chunks and
+            ranges of label indices to work on (tuples of chunk index,
+            slot index in `label_array`, start label index, and stop
+            label index). The worker stops when it gets `None`.
         event_queue:
             Queue in which the worker puts the extracted event feature
-            data.
+            data (one list of tuples of frame index and event dictionary
+            for each range of label indices from `raw_queue`).
         log_queue:
             Logging queue, used for sending messages to the main Process.
         feat_nevents:
@@ -61,10 +64,19 @@ class QueueEventExtractor:
             events per input frame is written. This array must be initialized
             with -1 (all values minus one).
         label_array:
-            Shared array containing the labels of one chunk from `data`.
+            Shared array containing the labels of one chunk from `data`
+            for each slot of the segmenter-extractor pipeline (or of one
+            chunk, if the manager copies the labels).
+        duplicate_frames:
+            Shared int8 array of same length as data which indicates
+            whether an input frame is identical to the previous frame
+            (1) or not (0). This is set for each chunk by the
+            :class:`.EventExtractorManagerThread`. For values of -1,
+            the frames are compared in :func:`process_label` and the
+            result is stored.
         finalize_extraction:
-            Shared value indicating whether this worker should stop as
-            soon as the `raw_queue` is empty.
+            Shared value which the manager sets when it stopped
+            putting work into `raw_queue`.
         extract_kwargs:
             Keyword arguments for the extraction process. See the
             keyword-only arguments in
@@ -91,7 +103,9 @@ class QueueEventExtractor:
         self.feat_nevents = feat_nevents
         #: Shared array containing the labels of one chunk from `data`.
         self.label_array = label_array
-        #: Set to True to let worker join when `raw_queue` is empty.
+        #: Shared array indicating which frames are duplicates
+        self.duplicate_frames = duplicate_frames
+        #: Set to True when no more work is put into `raw_queue`.
         self.finalize_extraction = finalize_extraction
         # Keyword arguments for data extraction
         if extract_kwargs is None:
@@ -106,16 +120,25 @@ class QueueEventExtractor:
         self.logger = None
 
     @staticmethod
-    def get_init_kwargs(data, gate, preselect, ptp_median, log_queue):
+    def get_init_kwargs(data, gate, preselect, ptp_median, log_queue,
+                        num_slots=1):
         """You can pass `*args.values()` directly to __init__
 
         This method was created for convenience reasons:
         - It makes sure that the order of arguments is correct, since it
           is implemented in the same class.
         - It simplifies testing.
+
+        The shared `label_array` has room for the labels of `num_slots`
+        chunks. If the segmenter writes the labels directly to the
+        shared memory (see :func:`QueueEventExtractor.get_labels_list`),
+        this must be the number of slots of the segmenter-extractor
+        pipeline. Otherwise, the default of one chunk is sufficient.
         """
-        # queue with the raw (unsegmented) image data
-        raw_queue = mp.Queue()
+        # queue with the raw (unsegmented) image data; the workers
+        # call `task_done` for every item, so that the manager can
+        # `join` the queue to wait for a chunk to be processed
+        raw_queue = mp.JoinableQueue()
         # queue with event-wise feature dictionaries
         event_queue = mp.Queue()
 
@@ -127,15 +150,38 @@ class QueueEventExtractor:
         args["raw_queue"] = raw_queue
         args["event_queue"] = event_queue
         args["log_queue"] = log_queue
-        args["feat_nevents"] = mp.Array("i", len(data))
-        args["feat_nevents"][:] = np.full(len(data), -1)
+        # The workers write to distinct indices, so no lock is needed.
+        args["feat_nevents"] = mp.RawArray("i", len(data))
+        np.ctypeslib.as_array(args["feat_nevents"])[:] = -1
         # "h" is signed short (np.int16)
         args["label_array"] = mp.RawArray(
             np.ctypeslib.ctypes.c_int16,
-            int(np.product(data.image.chunk_shape)))
+            int(np.product(data.image.chunk_shape)) * num_slots)
+        # "b" is signed char (np.int8), -1 means "not determined yet"
+        args["duplicate_frames"] = mp.RawArray("b", len(data))
+        np.ctypeslib.as_array(args["duplicate_frames"])[:] = -1
         args["finalize_extraction"] = mp.Value("b", False)
         return args
 
+    @staticmethod
+    def get_labels_list(fe_kwargs):
+        """Return a list of per-slot numpy views on the shared label array
+
+        Pass this list as `labels_list` to the
+        :class:`.SegmenterManagerThread`, so that the segmenter writes
+        the labels directly to the shared memory that the workers read
+        from (no extra copy per chunk).
+
+        Parameters
+        ----------
+        fe_kwargs: dict
+            Keyword arguments from :func:`get_init_kwargs`
+        """
+        chunk_shape = fe_kwargs["data"].image.chunk_shape
+        label_array = np.ctypeslib.as_array(
+            fe_kwargs["label_array"]).reshape(-1, *chunk_shape)
+        return list(label_array)
+
     @classmethod
     def get_ppid_from_kwargs(cls, kwargs):
         """Return the pipeline ID for this event extractor"""
@@ -170,9 +216,13 @@ class QueueEventExtractor:
         # gating on feature arrays
         if self.gate.box_gates:
             valid = self.gate.gate_events(events)
-            gated_events = {}
-            for key in events:
-                gated_events[key] = events[key][valid]
+            if np.all(valid):
+                # Nothing to remove, avoid copying the feature arrays.
+                gated_events = events
+            else:
+                gated_events = {}
+                for key in events:
+                    gated_events[key] = events[key][valid]
         else:
             gated_events = events
 
@@ -180,16 +230,14 @@ class QueueEventExtractor:
 
     def get_masks_from_label(self, label):
         """Get masks, performing mask-based gating"""
-        # Using np.unique is a little slower than iterating over lmax
-        # unu = np.unique(label)  # background is 0
-        lmax = np.max(label)
-        masks = []
-        for jj in range(1, lmax+1):  # first item is 0
-            mask_jj = label == jj
-            mask_sum = np.sum(mask_jj)
-            if mask_sum and self.gate.gate_mask(mask_jj, mask_sum=mask_sum):
-                masks.append(mask_jj)
-        return np.array(masks)
+        # Compute the areas of all labels in one pass (background is 0)
+        areas = np.bincount(label[label > 0])[1:]
+        valid = np.logical_and(areas > 0, self.gate.gate_mask_sums(areas))
+        # Use the dtype of `label`, otherwise the comparison below
+        # converts all of `label` to a larger integer type.
+        labels_valid = np.array(np.nonzero(valid)[0] + 1, dtype=label.dtype)
+        # Only create the masks of the labels that passed the gate
+        return label[np.newaxis] == labels_valid[:, np.newaxis, np.newaxis]
 
     def get_ppid(self):
         """Return a unique feature extractor pipeline identifier
@@ -214,11 +262,18 @@ class QueueEventExtractor:
         """
         return self.get_ppid_from_kwargs(self.extract_kwargs)
 
+    def is_duplicate_frame(self, index):
+        """Return True if a frame is identical to the previous frame"""
+        duplicate = self.duplicate_frames[index]
+        if duplicate < 0:
+            duplicate = index > 0 and np.array_equal(
+                self.data.image[index - 1], self.data.image[index])
+            self.duplicate_frames[index] = duplicate
+        return bool(duplicate)
+
     def process_label(self, label, index):
         """Process one label image, extracting masks and features"""
-        if (np.all(self.data.image[index - 1] == self.data.image[index])
-                and index):
-            # TODO: Do this before segmentation already?
+        if self.is_duplicate_frame(index):
             # skip events that have been analyzed already
             return None
         if self.preselect:
@@ -234,6 +289,35 @@ class QueueEventExtractor:
             events = None
         return events
 
+    def process_label_range(self, labels, chunk_index, label_start,
+                            label_stop):
+        """Process a range of label images of one chunk
+
+        The features of all frames are put into the `event_queue` at
+        once and the number of events per frame is written to
+        `feat_nevents`.
+        """
+        chunk_offset = chunk_index * self.data.image.chunk_size
+        # Sending one item for the entire range through the queue
+        # is a lot faster than sending one item per frame.
+        events_list = []
+        for label_index in range(label_start, label_stop):
+            index = chunk_offset + label_index
+            try:
+                events = self.process_label(label=labels[label_index],
+                                            index=index)
+            except BaseException:
+                self.logger.error(traceback.format_exc())
+            else:
+                if events:
+                    self.feat_nevents[index] = len(
+                        next(iter(events.values())))
+                else:
+                    self.feat_nevents[index] = 0
+                events_list.append((index, events))
+        if events_list:
+            self.event_queue.put(events_list)
+
     def run(self):
         """Main loop of worker process"""
         # Don't wait for queues when joining workers
@@ -248,32 +332,27 @@ class QueueEventExtractor:
         self.logger.debug(f"Running {self} in PID {os.getpid()}")
 
         mp_array = np.ctypeslib.as_array(
-            self.label_array).reshape(self.data.image.chunk_shape)
+            self.label_array).reshape(-1, *self.data.image.chunk_shape)
         while True:
+            item = self.raw_queue.get()
+            if item is None:
+                # The manager told us that there is nothing more coming.
+                self.raw_queue.task_done()
+                self.logger.debug(
+                    f"Finalizing worker {self} with PID {os.getpid()}. "
+                    f"{self.event_queue.qsize()} event lists are still "
+                    f"queued.")
+                break
+            chunk_index, label_slot, label_start, label_stop = item
             try:
-                chunk_index, label_index = self.raw_queue.get(timeout=.03)
-                index = chunk_index * self.data.image.chunk_size + label_index
-            except queue.Empty:
-                if self.finalize_extraction.value:
-                    # The manager told us that there is nothing more coming.
-                    self.logger.debug(
-                        f"Finalizing worker {self} with PID {os.getpid()}. "
-                        f"{self.event_queue.qsize()} events are still queued.")
-                    break
-            else:
-                try:
-                    events = self.process_label(
-                        label=mp_array[label_index],
-                        index=index)
-                except BaseException:
-                    self.logger.error(traceback.format_exc())
-                else:
-                    if events:
-                        key0 = list(events.keys())[0]
-                        self.feat_nevents[index] = len(events[key0])
-                    else:
-                        self.feat_nevents[index] = 0
-                    self.event_queue.put((index, events))
+                self.process_label_range(mp_array[label_slot],
+                                         chunk_index,
+                                         label_start,
+                                         label_stop)
+            finally:
+                # The manager joins `raw_queue`, so this must also
+                # happen if something goes wrong.
+                self.raw_queue.task_done()
         self.logger.debug(f"End of `run` for PID {os.getpid()}, {self}")
 
 
@@ -1,7 +1,10 @@
 import collections
+from concurrent.futures import ThreadPoolExecutor
 import functools
 import hashlib
+import os
 import pathlib
+import threading
 
 import h5py
 import numpy as np
@@ -12,7 +15,8 @@ class HDF5ImageCache:
                  h5ds: h5py.Dataset,
                  chunk_size: int = 1000,
                  cache_size: int = 5,
-                 boolean: bool = False):
+                 boolean: bool = False,
+                 prefetch: bool = False):
         """An HDF5 image cache
 
         Deformability cytometry data files commonly contain image stacks
@@ -21,22 +25,37 @@ class HDF5ImageCache:
         loaded, decompressed and from that one image extracted. The
         `HDF5ImageCache` class caches the chunks from the HDF5 files
         into memory, making single-image-access very fast.
+
+        If `prefetch` is set and the chunks are accessed sequentially,
+        then the chunk following a newly loaded chunk is read in a
+        background thread. Only use this if the data are processed
+        in order.
         """
-        # TODO:
-        # - adjust chunking to multiples of the chunks in the dataset
-        #   (which will slightly speed up things)
         chunk_size = min(h5ds.shape[0], chunk_size)
         self.h5ds = h5ds
         self.chunk_size = chunk_size
         self.boolean = boolean
         self.cache_size = cache_size
-        #: This is a FILO cache for the chunks
+        #: This is a FIFO cache for the chunks (the oldest chunk is removed)
         self.cache = collections.OrderedDict()
         self.shape = h5ds.shape
         self.image_shape = self.shape[1:]
         self.chunk_shape = (chunk_size,) + self.shape[1:]
         self._len = self.shape[0]
         self.num_chunks = int(np.ceil(self._len / self.chunk_size))
+        #: Whether to read the next chunk in a background thread
+        self.prefetch = prefetch
+        #: Read buffer for boolean data (allocated when needed)
+        self._buffer = None
+        # Tuple of chunk index and future of the chunk being prefetched
+        self._prefetched = None
+        # Thread pool for prefetching (see `_get_executor`)
+        self._executor = None
+        self._executor_pid = None
+        # Locks for reading data and for `_prefetched` (see `_check_pid`)
+        self._read_lock = threading.Lock()
+        self._prefetch_lock = threading.Lock()
+        self._lock_pid = os.getpid()
 
     def _get_chunk_index_for_index(self, index):
         if index < 0:
@@ -56,21 +75,103 @@ class HDF5ImageCache:
     def __len__(self):
         return self._len
 
+    def _check_pid(self):
+        """Create new locks if we are in a forked process
+
+        Locks are copied in their current state when a process is
+        forked (e.g. held by another thread reading data), so the
+        child process needs its own locks.
+        """
+        pid = os.getpid()
+        if self._lock_pid != pid:
+            self._read_lock = threading.Lock()
+            self._prefetch_lock = threading.Lock()
+            self._prefetched = None
+            self._lock_pid = pid
+
+    def _get_executor(self):
+        """Return the prefetching thread pool for the current process"""
+        self._check_pid()
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            # Threads are not inherited by forked processes, so we
+            # create a new thread pool.
+            self._executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="HDF5ImageCachePrefetch")
+            self._executor_pid = pid
+        return self._executor
+
+    def _get_chunk_prefetch(self, chunk_index):
+        """Read one chunk, using and starting the read-ahead"""
+        executor = self._get_executor()
+        with self._prefetch_lock:
+            prefetched = self._prefetched
+            self._prefetched = None
+            if prefetched is not None and prefetched[0] == chunk_index:
+                data = prefetched[1].result()
+            else:
+                if prefetched is not None:
+                    prefetched[1].cancel()
+                data = self._read_chunk(chunk_index)
+            next_index = chunk_index + 1
+            # Only read ahead if the chunks are accessed sequentially.
+            if ((chunk_index == 0 or chunk_index - 1 in self.cache)
+                    and next_index < self.num_chunks
+                    and next_index not in self.cache):
+                self._prefetched = (
+                    next_index,
+                    executor.submit(self._read_chunk, next_index))
+        return data
+
+    def _read_chunk(self, chunk_index):
+        """Read one chunk of images from `self.h5ds`"""
+        fslice = slice(self.chunk_size * chunk_index,
+                       self.chunk_size * (chunk_index + 1)
+                       )
+        with self._read_lock:
+            if self.boolean:
+                # Read the data into a reusable buffer, so that only the
+                # boolean array has to be allocated.
+                if self._buffer is None:
+                    self._buffer = np.empty(self.chunk_shape,
+                                            dtype=self.h5ds.dtype)
+                buffer = self._buffer[:self.get_chunk_size(chunk_index)]
+                self.h5ds.read_direct(buffer, source_sel=fslice)
+                data = np.not_equal(buffer, 0)
+            else:
+                data = self.h5ds[fslice]
+        return data
+
     def get_chunk(self, chunk_index):
         """Return one chunk of images"""
         if chunk_index not in self.cache:
-            fslice = slice(self.chunk_size * chunk_index,
-                           self.chunk_size * (chunk_index + 1)
-                           )
-            data = self.h5ds[fslice]
-            if self.boolean:
-                data = np.array(data, dtype=bool)
+            self._check_pid()
+            if self.prefetch:
+                data = self._get_chunk_prefetch(chunk_index)
+            else:
+                data = self._read_chunk(chunk_index)
             self.cache[chunk_index] = data
             if len(self.cache) > self.cache_size:
                 # Remove the first item
                 self.cache.popitem(last=False)
         return self.cache[chunk_index]
 
+    def close(self):
+        """Stop prefetching; Call this before closing the HDF5 file"""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            # Only the process that started prefetching can stop it.
+            with self._prefetch_lock:
+                prefetched = self._prefetched
+                self._prefetched = None
+            if prefetched is not None:
+                prefetched[1].cancel()
+            # Wait for a running read to finish.
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        self._prefetched = None
+        self._executor = None
+        self._executor_pid = None
+
     def get_chunk_size(self, chunk_index):
         """Return the number of images in this chunk"""
         if chunk_index < self.num_chunks - 1:
@@ -104,7 +205,7 @@ class ImageCorrCache:
         self.h5ds = image.h5ds
         self.shape = image.shape
         self.chunk_shape = image.chunk_shape
-        #: This is a FILO cache for the corrected image chunks
+        #: This is a FIFO cache for the corrected image chunks
         self.cache = collections.OrderedDict()
         self.cache_size = image.cache_size
 
@@ -124,9 +225,14 @@ class ImageCorrCache:
 
     def get_chunk(self, chunk_index):
         if chunk_index not in self.cache:
-            data = np.array(
-                self.image.get_chunk(chunk_index), dtype=np.int16) \
-                - self.image_bg.get_chunk(chunk_index)
+            image_chunk = self.image.get_chunk(chunk_index)
+            # Subtract in int16 directly into the output array (avoids
+            # an intermediate int16 copy of the image chunk).
+            data = np.empty(image_chunk.shape, dtype=np.int16)
+            np.subtract(image_chunk,
+                        self.image_bg.get_chunk(chunk_index),
+                        out=data,
+                        dtype=np.int16)
             self.cache[chunk_index] = data
             if len(self.cache) > self.cache_size:
                 # Remove the first item
@@ -137,6 +243,23 @@ class ImageCorrCache:
         return self.image.iter_chunks()
 
 
+def get_aligned_chunk_size(h5ds, chunk_size=1000):
+    """Return a chunk size that is a multiple of the chunks of `h5ds`
+
+    If the application chunks are aligned to the chunks of the
+    HDF5 dataset on disk, then every HDF5 chunk only has to be read
+    and decompressed once. The returned value is the largest multiple
+    of the first dimension of `h5ds.chunks` that is not larger than
+    `chunk_size`. If `h5ds` is not chunked or if its chunks are larger
+    than `chunk_size`, `chunk_size` is returned.
+    """
+    if h5ds.chunks is not None:
+        ds_chunk_size = h5ds.chunks[0]
+        if ds_chunk_size <= chunk_size:
+            chunk_size = chunk_size // ds_chunk_size * ds_chunk_size
+    return chunk_size
+
+
 @functools.cache
 def md5sum(path, blocksize=65536, count=0):
     """Compute (partial) MD5 sum of a file
@@ -147,14 +270,17 @@ def md5sum(path, blocksize=65536, count=0):
         path to the file
     blocksize: int
         block size in bytes read from the file
-        (set to `0` to hash the entire file)
     count: int
         number of blocks read from the file
+        (set to `0` to hash the entire file)
     """
     path = pathlib.Path(path)
 
     hasher = hashlib.md5()
     with path.open('rb') as fd:
+        if hasattr(os, "posix_fadvise"):
+            # Tell the OS that we are reading the file sequentially.
+            os.posix_fadvise(fd.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
         ii = 0
         while len(buf := fd.read(blocksize)) > 0:
             hasher.update(buf)
@@ -11,7 +11,9 @@ import warnings
 import h5py
 import numpy as np
 
-from .cache import HDF5ImageCache, ImageCorrCache, md5sum
+from .cache import (
+    HDF5ImageCache, ImageCorrCache, get_aligned_chunk_size, md5sum
+)
 from .const import PROTECTED_FEATURES
 
 
@@ -90,8 +92,8 @@ class HDF5Data:
         self.md5_5m = state["md5_5m"]
         if self.md5_5m is None:
             if isinstance(self.path, pathlib.Path):
-                # 5MB md5sum of input file
-                self.md5_5m = md5sum(self.path, count=80)
+                # 5MB md5sum of input file (read in blocks of 1 MiB)
+                self.md5_5m = md5sum(self.path, blocksize=2**20, count=5)
             else:
                 self.md5_5m = str(uuid.uuid4()).replace("-", "")
         self.logs = state["logs"]
@@ -135,13 +137,18 @@ class HDF5Data:
 
         if self.h5 is None:
             self.h5 = h5py.File(self.path, libver="latest")
+        # All image caches must use the same chunk size, which we
+        # align to the chunks of the image data on disk.
+        chunk_size = get_aligned_chunk_size(self.h5["events/image"])
         self.image = HDF5ImageCache(
             self.h5["events/image"],
+            chunk_size=chunk_size,
             cache_size=state["image_cache_size"])
 
         if "events/image_bg" in self.h5:
             self.image_bg = HDF5ImageCache(
                 self.h5["events/image_bg"],
+                chunk_size=chunk_size,
                 cache_size=state["image_cache_size"])
         else:
             self.image_bg = None
@@ -149,6 +156,7 @@ class HDF5Data:
         if "events/mask" in self.h5:
             self.mask = HDF5ImageCache(
                 self.h5["events/mask"],
+                chunk_size=chunk_size,
                 cache_size=state["image_cache_size"],
                 boolean=True)
         else:
@@ -182,6 +190,9 @@ class HDF5Data:
 
     def close(self):
         """Close the underlying HDF5 file"""
+        for cache in [self.image, self.image_bg, self.mask]:
+            if cache is not None:
+                cache.close()
         self.h5.close()
 
     @functools.cache
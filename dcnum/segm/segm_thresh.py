@@ -1,3 +1,5 @@
+import numpy as np
+
 from .segmenter_cpu import CPUSegmenter
 
 
@@ -18,7 +20,7 @@ class SegmentThresh(CPUSegmenter):
         super(SegmentThresh, self).__init__(thresh=thresh, *args, **kwargs)
 
     @staticmethod
-    def segment_approach(image, *,
+    def segment_approach(image, out=None, *,
                          thresh: float = -6):
         """Mask retrieval as it is done in Shape-In
 
@@ -26,6 +28,9 @@ class SegmentThresh(CPUSegmenter):
         ----------
         image: 2d ndarray
             Background-corrected frame image
+        out: 2d boolean ndarray
+            Optional preallocated output array with the same shape
+            as `image` (avoids allocating a new mask for every frame)
         thresh: float
             Threshold value for creation of binary mask; a negative value
             means that pixels darker than the background define the threshold
@@ -37,4 +42,4 @@ class SegmentThresh(CPUSegmenter):
             Mask image for the give index
         """
         assert thresh < 0, "threshold values above zero not supported!"
-        return image < thresh
+        return np.less(image, thresh, out=out)
@@ -149,14 +149,14 @@ class Segmenter(abc.ABC):
             #
             if (labels[0, :].sum() or labels[-1, :].sum()
                     or labels[:, 0].sum() or labels[:, -1].sum()):
-                border = np.zeros_like(labels, dtype=bool)
-                border[0] = True
-                border[-1] = True
-                border[:, 0] = True
-                border[:, -1] = True
-                indices = sorted(np.unique(labels[border]))
-                for ii in indices[1:]:
-                    labels[labels == ii] = 0
+                border = np.concatenate([labels[0, :], labels[-1, :],
+                                         labels[:, 0], labels[:, -1]])
+                indices = np.unique(border)
+                # Remove all border labels in one pass over the image
+                # using a lookup table (instead of one pass per label).
+                remove = np.zeros(labels.max() + 1, dtype=bool)
+                remove[indices[1:]] = True
+                labels[remove[labels]] = 0
 
         # scikit-image is too slow for us here. So we use OpenCV.
         # https://github.com/scikit-image/scikit-image/issues/1190
@@ -173,9 +173,14 @@ class Segmenter(abc.ABC):
             labels_uint8 = np.array(labels, dtype=np.uint8)
             labels_dilated = cv2.dilate(labels_uint8, element)
             labels_eroded = cv2.erode(labels_dilated, element)
-            labels, _ = ndi.label(
-                input=labels_eroded > 0,
-                structure=ndi.generate_binary_structure(2, 2))
+            if fill_holes:
+                # Filling holes only distinguishes between background
+                # and foreground and labels the image anyway.
+                labels = np.array(labels_eroded > 0, dtype=np.int32)
+            else:
+                labels, _ = ndi.label(
+                    input=labels_eroded > 0,
+                    structure=ndi.generate_binary_structure(2, 2))
 
         if fill_holes:
             # Floodfill only works with uint8 (too small) or int32
@@ -201,11 +206,19 @@ class Segmenter(abc.ABC):
         data = image_data.get_chunk(chunk)
         return self.segment_batch(data)
 
-    def segment_frame(self, image):
-        """Return the integer label image for `index`"""
+    def segment_frame(self, image, out=None):
+        """Return the integer label image for `index`
+
+        If `segment_approach` accepts an `out` argument, the boolean
+        array `out` (same shape as `image`) is used as a buffer for
+        the intermediate mask image.
+        """
         segm_wrap = self.segment_frame_wrapper()
         # obtain mask or label
-        mol = segm_wrap(image)
+        if out is not None and self.segment_approach_accepts_out():
+            mol = segm_wrap(image, out)
+        else:
+            mol = segm_wrap(image)
         if mol.dtype == bool:
             # convert mask to label
             labels, _ = ndi.label(
@@ -218,6 +231,13 @@ class Segmenter(abc.ABC):
             labels = self.process_mask(labels, **self.kwargs_mask)
         return labels
 
+    @classmethod
+    @functools.cache
+    def segment_approach_accepts_out(cls):
+        """Whether `segment_approach` accepts an `out` buffer argument"""
+        spec = inspect.getfullargspec(cls.segment_approach)
+        return "out" in spec.args
+
     @functools.cache
     def segment_frame_wrapper(self):
         if self.kwargs:
@@ -241,6 +241,8 @@ class CPUSegmenterWorker:
             -1, self.image_shape[0], self.image_shape[1])
         image_data = np.ctypeslib.as_array(self.image_data_raw).reshape(
             -1, self.image_shape[0], self.image_shape[1])
+        # Persistent buffer for the intermediate mask image
+        mask_buffer = np.empty(self.image_shape, dtype=bool)
 
         idx = self.sl_start
         itr = 0  # current iteration (incremented when we reach self.sl_stop)
@@ -255,7 +257,7 @@ class CPUSegmenterWorker:
                         self.batch_worker.value += 1
                 else:
                     labels_data[idx, :, :] = self.segmenter.segment_frame(
-                        image_data[idx])
+                        image_data[idx], out=mask_buffer)
                     idx += 1
             elif self.shutdown.value:
                 break
@@ -2,6 +2,7 @@ import logging
 import multiprocessing as mp
 import time
 import threading
+from typing import List
 
 import numpy as np
 
@@ -17,6 +18,8 @@ class SegmenterManagerThread(threading.Thread):
                  image_data: HDF5ImageCache | ImageCorrCache,
                  slot_states: mp.Array,
                  slot_chunks: mp.Array,
+                 labels_list: List = None,
+                 slot_event: threading.Event = None,
                  debug: bool = False,
                  *args, **kwargs):
         """Manage the segmentation of image data
@@ -38,6 +41,18 @@ class SegmenterManagerThread(threading.Thread):
         slot_chunks:
             For each slot in `slot_states`, this shared array defines
             on which chunk in `image_data` the segmentation took place.
+        labels_list:
+            Optional list of preallocated label arrays (one for each
+            slot) into which the labels are written, e.g. the shared
+            memory views from
+            :func:`.QueueEventExtractor.get_labels_list`. If not set,
+            a new array is allocated for each segmented chunk.
+        slot_event:
+            Optional event which is set whenever a slot is handed over
+            to the extractor. Pass the same event to the
+            :class:`.EventExtractorManagerThread`, so that it does not
+            have to poll `slot_states`. If not set, a new event is
+            created.
         debug:
             Whether to run in debugging mode (more verbose messages and
             CPU-based segmentation is done in one single thread instead
@@ -69,8 +84,14 @@ class SegmenterManagerThread(threading.Thread):
         self.slot_states = slot_states
         #: Current slot chunk index for the slot states
         self.slot_chunks = slot_chunks
+        if labels_list is not None and len(labels_list) != len(slot_states):
+            raise ValueError(
+                f"`labels_list` must have one item for each of the "
+                f"{len(slot_states)} slots, got {len(labels_list)}!")
         #: List containing the segmented labels of each slot
-        self.labels_list = [None] * len(self.slot_states)
+        self.labels_list = labels_list or [None] * len(self.slot_states)
+        #: Event that is set when a slot is handed over to the extractor
+        self.slot_event = slot_event or threading.Event()
         #: Time counter for segmentation
         self.t_count = 0
         #: Whether running in debugging mode
@@ -105,14 +126,18 @@ class SegmenterManagerThread(threading.Thread):
                 image_data=self.image_data,
                 chunk=chunk)
 
-            # TODO: make this more memory efficient (pre-shared mp.Arrays?)
             # Store labels in a list accessible by the main thread
-            self.labels_list[cur_slot] = np.copy(labels)
+            slot_labels = self.labels_list[cur_slot]
+            if slot_labels is None:
+                self.labels_list[cur_slot] = np.copy(labels)
+            else:
+                slot_labels[:len(labels)] = labels
             # Remember the chunk index for this slot
             self.slot_chunks[cur_slot] = chunk
             # This must be done last: Let the extractor know that this
             # slot is ready for processing.
             self.slot_states[cur_slot] = "e"
+            self.slot_event.set()
             self.logger.debug(f"Segmented one chunk: {chunk}")
 
             self.t_count += time.monotonic() - t1
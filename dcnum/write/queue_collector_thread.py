@@ -120,7 +120,7 @@ class QueueCollectorThread(threading.Thread):
             information
         event_queue:
             A queue object to which other processes or threads write
-            events as tuples `(frame_index, events_dict)`.
+            events as lists of tuples `(frame_index, events_dict)`.
         writer_dq:
             A :class:`DequeWriterThread` should be attached to the
             other end of this :class:`collections.deque`.
@@ -214,16 +214,17 @@ class QueueCollectorThread(threading.Thread):
             # that belongs to our chunk (this might also populate buffer_dq).
             while True:
                 try:
-                    idx, events = self.event_queue.get(timeout=.3)
+                    events_list = self.event_queue.get(timeout=.3)
                 except queue.Empty:
                     # No time.sleep here, because we are using timeout above.
                     continue
-                if cur_frame <= idx < cur_frame + self.write_threshold:
-                    stash.add_events(index=idx, events=events)
-                else:
-                    # Goes onto the buffer stack (might happen if some other
-                    # processes were faster)
-                    self.buffer_dq.append((idx, events))
+                for idx, events in events_list:
+                    if cur_frame <= idx < cur_frame + self.write_threshold:
+                        stash.add_events(index=idx, events=events)
+                    else:
+                        # Goes onto the buffer stack (might happen if some
+                        # other processes were faster)
+                        self.buffer_dq.append((idx, events))
                 if stash.is_complete():
                     break
 
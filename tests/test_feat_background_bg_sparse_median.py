@@ -0,0 +1,203 @@
+import h5py
+import numpy as np
+import pytest
+
+from dcnum.feat.feat_background import bg_sparse_median
+
+
+@pytest.mark.parametrize("kernel_size", [1, 2, 7, 10])
+def test_median_uint8_columns(kernel_size):
+    rng = np.random.default_rng(42)
+    data = rng.integers(0, 256, size=(kernel_size, 35), dtype=np.uint8)
+    out = np.zeros(35, dtype=np.uint8)
+    bg_sparse_median.median_uint8_columns(data, out)
+    kth = kernel_size // 2
+    assert np.all(out == np.partition(data, kth, axis=0)[kth])
+
+
+def test_median_uint8_columns_slice():
+    data = np.arange(5*7, dtype=np.uint8).reshape(1, 5*7) * np.ones(
+        (10, 1), dtype=np.uint8)
+    data[::2] += 1
+    out = np.zeros(5*7, dtype=np.uint8)
+    job_slice = slice(1, 4)
+    bg_sparse_median.median_uint8_columns(data[:, job_slice],
+                                          out[job_slice])
+    assert np.all(out[job_slice] == np.arange(1, 4) + 1)
+    # other values are not touched
+    assert np.all(out[4:] == 0)
+    assert out[0] == 0
+
+
+@pytest.mark.parametrize("event_count", [720, 730])
+@pytest.mark.parametrize("frac_cleansing", [1, .8])
+def test_median_sparse_process_full(tmp_path, event_count, frac_cleansing):
+    input_path = tmp_path / "input.h5"
+    output_path = tmp_path / "test.h5"
+    # image shape: 5 * 7
+    # kernel size: 10
+    input_data = np.arange(5*7).reshape(1, 5, 7) * np.ones((event_count, 1, 1))
+    input_data = np.array(input_data, dtype=np.uint8)
+    # add some outliers
+    input_data[::3, 2, 3] = 200
+    with h5py.File(input_path, "w") as h5:
+        h5["events/image"] = input_data
+        h5["events/time"] = np.linspace(0, 7, event_count)
+
+    with bg_sparse_median.BackgroundSparseMed(input_data=input_path,
+                                              output_path=output_path,
+                                              kernel_size=10,
+                                              split_time=1.,
+                                              frac_cleansing=frac_cleansing,
+                                              num_cpus=2,
+                                              ) as bic:
+        assert bic.step_times.size == 7
+        assert bic.job_slices == [slice(0, 17), slice(17, 35)]
+        bic.process()
+
+    reference = np.arange(5*7, dtype=np.uint8).reshape(5, 7)
+    with h5py.File(output_path) as h5:
+        ds = h5["events/image_bg"]
+        assert ds.shape == (event_count, 5, 7)
+        assert np.all(ds[:] == reference)
+
+
+def test_ptp_uint8_rows():
+    rng = np.random.default_rng(42)
+    images = rng.integers(0, 256, size=(3, 5, 7), dtype=np.uint8)
+    assert np.all(bg_sparse_median.ptp_uint8_rows(images)
+                  == np.ptp(images, axis=2))
+    # single column
+    assert np.all(bg_sparse_median.ptp_uint8_rows(images[:, :, :1]) == 0)
+
+
+def test_median_sparse_get_window(tmp_path):
+    input_path = tmp_path / "input.h5"
+    output_path = tmp_path / "test.h5"
+    event_count = 100
+    input_data = np.arange(event_count, dtype=np.uint8).reshape(-1, 1, 1) \
+        * np.ones((1, 5, 7), dtype=np.uint8)
+    with h5py.File(input_path, "w") as h5:
+        h5["events/image"] = input_data
+        h5["events/time"] = np.linspace(0, 1, event_count)
+
+    with bg_sparse_median.BackgroundSparseMed(input_data=input_path,
+                                              output_path=output_path,
+                                              kernel_size=10,
+                                              num_cpus=1,
+                                              ) as bic:
+        for start in [0, 4, 12, 20, 15, 90]:
+            window = bic.get_window(start, start + 10)
+            assert window.shape == (10, 5 * 7)
+            # the order of the events in the window is not defined
+            assert np.all(np.sort(window[:, 0]) == np.arange(start,
+                                                             start + 10))
+            assert np.all(window == window[:, :1])
+
+    # numpy arrays are not copied
+    with bg_sparse_median.BackgroundSparseMed(input_data=input_path,
+                                              output_path=output_path,
+                                              kernel_size=10,
+                                              num_cpus=1,
+                                              ) as bic:
+        bic.input_data = input_data
+        window = bic.get_window(4, 14)
+        assert np.shares_memory(window, input_data)
+        assert np.all(window[:, 0] == np.arange(4, 14))
+
+
+def test_median_sparse_process_second(tmp_path):
+    input_path = tmp_path / "input.h5"
+    output_path = tmp_path / "test.h5"
+    event_count = 300
+    rng = np.random.default_rng(42)
+    input_data = rng.integers(0, 256, size=(event_count, 5, 7),
+                              dtype=np.uint8)
+    with h5py.File(input_path, "w") as h5:
+        h5["events/image"] = input_data
+        # overlapping and non-overlapping windows
+        h5["events/time"] = np.sort(rng.uniform(0, 20, event_count))
+
+    with bg_sparse_median.BackgroundSparseMed(input_data=input_path,
+                                              output_path=output_path,
+                                              kernel_size=20,
+                                              num_cpus=2,
+                                              ) as bic:
+        for ii, second in enumerate(bic.step_times):
+            bic.process_second(ii, second)
+            idx_start, idx_stop = bic.get_window_range(second)
+            assert np.all(bic.bg_images[ii] == np.partition(
+                input_data[idx_start:idx_stop], 10, axis=0)[10])
+
+
+def test_median_sparse_get_window_range(tmp_path):
+    input_path = tmp_path / "input.h5"
+    output_path = tmp_path / "test.h5"
+    event_count = 100
+    rng = np.random.default_rng(42)
+    # rounding creates events with equal times
+    time = np.round(np.sort(rng.uniform(0, 10, event_count)), 1)
+    with h5py.File(input_path, "w") as h5:
+        h5["events/image"] = np.zeros((event_count, 5, 7), dtype=np.uint8)
+        h5["events/time"] = time
+
+    with bg_sparse_median.BackgroundSparseMed(input_data=input_path,
+                                              output_path=output_path,
+                                              kernel_size=10,
+                                              num_cpus=1,
+                                              ) as bic:
+        for second in np.linspace(-1, 11, 121):
+            idx_start = np.argmin(np.abs(second - bic.time))
+            idx_start = min(idx_start, event_count - 10)
+            assert bic.get_window_range(second) == (idx_start,
+                                                    idx_start + 10)
+
+
+def get_background_indices_loop(time, step_times, split_time):
+    """Reference implementation of `get_background_indices`"""
+    bg_idx = np.zeros(time.size, dtype=int)
+    idx0 = 0
+    for ii in range(len(step_times)):
+        t1 = step_times[ii]
+        idx1 = np.argmin(np.abs(time - t1 + split_time/2))
+        bg_idx[idx0:idx1] = ii
+        idx0 = idx1
+    # Fill up remainder of index array with last entry
+    bg_idx[idx1:] = ii
+    return bg_idx
+
+
+@pytest.mark.parametrize("time_axis", ["uniform", "irregular", "duplicates"])
+def test_median_sparse_get_background_indices(tmp_path, time_axis):
+    input_path = tmp_path / "input.h5"
+    output_path = tmp_path / "test.h5"
+    event_count = 500
+    rng = np.random.default_rng(42)
+    if time_axis == "uniform":
+        time = np.linspace(0, 10, event_count)
+    elif time_axis == "irregular":
+        time = np.sort(rng.uniform(0, 10, event_count))
+    else:
+        # many events with equal times
+        time = np.round(np.sort(rng.uniform(0, 10, event_count)), 1)
+    with h5py.File(input_path, "w") as h5:
+        h5["events/image"] = np.zeros((event_count, 5, 7), dtype=np.uint8)
+        h5["events/time"] = time
+
+    with bg_sparse_median.BackgroundSparseMed(input_data=input_path,
+                                              output_path=output_path,
+                                              kernel_size=10,
+                                              split_time=.5,
+                                              num_cpus=1,
+                                              ) as bic:
+        step_times = bic.step_times
+        assert step_times.size == 20
+        subsets = [step_times,
+                   # cleansed background series
+                   step_times[rng.random(step_times.size) < .8],
+                   step_times[[0, 1, 7, 8, 9, 19]],
+                   step_times[[5]]]
+        for st in subsets:
+            assert np.all(
+                bic.get_background_indices(st)
+                == get_background_indices_loop(bic.time, st, .5))
@@ -54,3 +54,20 @@ def test_basic_brightness_single_image():
         # control test
         assert not np.allclose(h5["events"]["bright_perc_10"][1],
                                data["bright_perc_90"][0])
+
+
+def test_basic_brightness_without_background():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with h5py.File(path) as h5:
+        data = feat_brightness.brightness_features(
+            image=h5["events/image"][:],
+            mask=h5["events/mask"][:],
+        )
+        for feat in ["bright_avg", "bright_sd"]:
+            assert np.allclose(h5["events"][feat][:],
+                               data[feat]), f"Feature {feat} mismatch!"
+        # background-corrected features cannot be computed
+        for feat in ["bg_med", "bright_bc_avg", "bright_bc_sd",
+                     "bright_perc_10", "bright_perc_90"]:
+            assert np.all(np.isnan(data[feat]))
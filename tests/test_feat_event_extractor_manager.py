@@ -0,0 +1,234 @@
+import multiprocessing as mp
+import pathlib
+import threading
+
+import h5py
+import numpy as np
+import pytest
+
+from dcnum import feat, read, segm
+
+from helper_methods import retrieve_data
+
+data_path = pathlib.Path(__file__).parent / "data"
+
+
+def get_fe_kwargs(data, num_slots=1):
+    return feat.QueueEventExtractor.get_init_kwargs(
+        data=data, gate=feat.Gate(data), preselect=False, ptp_median=None,
+        log_queue=mp.Queue(), num_slots=num_slots)
+
+
+def test_extractor_task_done_on_error(monkeypatch):
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        fe_kwargs = get_fe_kwargs(hd)
+        worker = feat.EventExtractorThread(*fe_kwargs.values())
+
+        def process_label_range(*args, **kwargs):
+            raise ValueError("Something went wrong")
+
+        monkeypatch.setattr(worker, "process_label_range",
+                            process_label_range)
+        fe_kwargs["raw_queue"].put((0, 0, 0, 10))
+        with pytest.raises(ValueError, match="Something went wrong"):
+            worker.run()
+        # The queue can be joined, because `task_done` was called.
+        joiner = threading.Thread(target=fe_kwargs["raw_queue"].join,
+                                  daemon=True)
+        joiner.start()
+        joiner.join(timeout=10)
+        assert not joiner.is_alive()
+
+
+def test_extractor_stops_on_none():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        fe_kwargs = get_fe_kwargs(hd)
+        worker = feat.EventExtractorThread(*fe_kwargs.values())
+        fe_kwargs["raw_queue"].put((0, 0, 0, 10))
+        fe_kwargs["raw_queue"].put(None)
+        worker.start()
+        worker.join(timeout=60)
+        assert not worker.is_alive()
+        # the first ten frames were processed
+        assert np.all(np.array(fe_kwargs["feat_nevents"][:10]) >= 0)
+        assert np.all(np.array(fe_kwargs["feat_nevents"][10:]) == -1)
+        events_list = fe_kwargs["event_queue"].get(timeout=10)
+        assert [idx for idx, _ in events_list] == list(range(10))
+
+
+def test_extractor_manager_worker_exited(monkeypatch):
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        fe_kwargs = get_fe_kwargs(hd)
+        slot_states = mp.Array("u", 1)
+        slot_states[:] = "e"
+        slot_chunks = mp.Array("i", 1)
+        labels_list = [np.zeros(hd.image.chunk_shape, dtype=np.int16)]
+        # workers that exit without processing anything
+        monkeypatch.setattr(feat.QueueEventExtractor, "run",
+                            lambda self: None)
+        emt = feat.EventExtractorManagerThread(
+            slot_states=slot_states,
+            slot_chunks=slot_chunks,
+            labels_list=labels_list,
+            fe_kwargs=fe_kwargs,
+            num_workers=1,
+            debug=True)
+        # The manager must not wait forever for the queue.
+        with pytest.raises(RuntimeError, match="exited before processing"):
+            emt.run()
+        assert fe_kwargs["finalize_extraction"].value
+        # The thread joining `raw_queue` must not be left behind.
+        assert not emt.queue_joiner.is_alive()
+
+
+def make_pipeline_data(path, event_count=1100):
+    """Create a dataset with `ii % 3` dark objects in frame `ii`
+
+    The HDF5 chunks are aligned to a chunk size of 960, so there is
+    a full chunk and a short last chunk. Frames 11 and 960 are
+    duplicates of the previous frames.
+    """
+    image_bg = np.full((event_count, 20, 40), 100, dtype=np.uint8)
+    image = image_bg.copy()
+    image[1::3, 5:9, 5:9] = 80
+    image[2::3, 5:9, 5:9] = 80
+    image[2::3, 10:14, 25:29] = 80
+    image[11] = image[10]
+    image[960] = image[959]
+    with h5py.File(path, "w") as h5:
+        h5.attrs["experiment:event count"] = event_count
+        h5.attrs["imaging:pixel size"] = 0.26
+        h5.create_dataset("events/image", data=image, chunks=(64, 20, 40))
+        h5.create_dataset("events/image_bg", data=image_bg,
+                          chunks=(64, 20, 40))
+
+
+@pytest.mark.parametrize("debug", [True, False])
+@pytest.mark.parametrize("shared", [True, False])
+def test_segmenter_extractor_pipeline(tmp_path, debug, shared):
+    path = tmp_path / "data.rtdc"
+    make_pipeline_data(path)
+    num_slots = 2
+    with read.HDF5Data(path) as hd:
+        assert hd.image.chunk_size == 960
+        assert hd.image.get_chunk_size(1) == 140
+        if shared:
+            fe_kwargs = get_fe_kwargs(hd, num_slots=num_slots)
+        else:
+            # The labels are copied to a `label_array` with one chunk.
+            fe_kwargs = get_fe_kwargs(hd)
+        # only compute the basic features
+        fe_kwargs["extract_kwargs"] = {"brightness": False,
+                                       "haralick": False}
+        slot_states = mp.Array("u", num_slots)
+        slot_states[:] = "s" * num_slots
+        slot_chunks = mp.Array("i", num_slots)
+        if shared:
+            labels_list = feat.QueueEventExtractor.get_labels_list(
+                fe_kwargs)
+        else:
+            labels_list = None
+        smt = segm.SegmenterManagerThread(
+            segmenter=segm.segm_thresh.SegmentThresh(thresh=-6,
+                                                     debug=debug),
+            image_data=hd.image_corr,
+            slot_states=slot_states,
+            slot_chunks=slot_chunks,
+            labels_list=labels_list,
+            debug=debug)
+        emt = feat.EventExtractorManagerThread(
+            slot_states=slot_states,
+            slot_chunks=slot_chunks,
+            labels_list=smt.labels_list,
+            fe_kwargs=fe_kwargs,
+            num_workers=2,
+            slot_event=smt.slot_event,
+            debug=debug)
+        smt.start()
+        emt.start()
+        # Get the events while the pipeline is running.
+        events = {}
+        while len(events) < len(hd):
+            for index, event in fe_kwargs["event_queue"].get(timeout=60):
+                events[index] = event
+        smt.join()
+        emt.join()
+
+        counts = np.arange(len(hd)) % 3
+        # duplicate frames are skipped
+        counts[[11, 960]] = 0
+        assert np.all(np.array(fe_kwargs["feat_nevents"][:]) == counts)
+        duplicates = np.ctypeslib.as_array(fe_kwargs["duplicate_frames"])
+        assert np.all(np.nonzero(duplicates)[0] == [11, 960])
+        for index in range(len(hd)):
+            if counts[index]:
+                assert len(events[index]["mask"]) == counts[index]
+            else:
+                assert events[index] is None
+
+
+def test_extractor_manager_set_duplicate_frames(tmp_path):
+    path = tmp_path / "data.rtdc"
+    make_pipeline_data(path)
+    with read.HDF5Data(path) as hd:
+        fe_kwargs = get_fe_kwargs(hd)
+        emt = feat.EventExtractorManagerThread(
+            slot_states=mp.Array("u", 1),
+            slot_chunks=mp.Array("i", 1),
+            labels_list=[None],
+            fe_kwargs=fe_kwargs,
+            num_workers=1)
+        duplicates = np.ctypeslib.as_array(fe_kwargs["duplicate_frames"])
+        # The second chunk comes first; the first chunk is not read.
+        emt.set_duplicate_frames(1)
+        assert 0 not in hd.image.cache
+        assert duplicates[960] == -1
+        assert np.all(duplicates[961:] == 0)
+        emt.set_duplicate_frames(0)
+        assert np.all(np.nonzero(duplicates[:960])[0] == [11])
+        # The chunks in order
+        duplicates[:] = -1
+        emt.set_duplicate_frames(0)
+        emt.set_duplicate_frames(1)
+        assert np.all(np.nonzero(duplicates)[0] == [11, 960])
+        assert not emt.last_frames
+
+
+def test_extractor_manager_bad_slots():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        fe_kwargs = get_fe_kwargs(hd, num_slots=1)
+        slot_states = mp.Array("u", 2)
+        slot_chunks = mp.Array("i", 2)
+        # The labels are copied, one chunk in `label_array` is enough.
+        feat.EventExtractorManagerThread(
+            slot_states=slot_states,
+            slot_chunks=slot_chunks,
+            labels_list=[None, None],
+            fe_kwargs=fe_kwargs,
+            num_workers=1)
+        # The labels are in shared memory, but there is only one chunk.
+        labels_shared = feat.QueueEventExtractor.get_labels_list(fe_kwargs)
+        labels_list = [labels_shared[0], labels_shared[0]]
+        with pytest.raises(ValueError, match="room for 1 chunks"):
+            feat.EventExtractorManagerThread(
+                slot_states=slot_states,
+                slot_chunks=slot_chunks,
+                labels_list=labels_list,
+                fe_kwargs=fe_kwargs,
+                num_workers=1)
+        with pytest.raises(ValueError, match="one item for each of the 2"):
+            segm.SegmenterManagerThread(
+                segmenter=segm.segm_thresh.SegmentThresh(thresh=-6),
+                image_data=hd.image_corr,
+                slot_states=slot_states,
+                slot_chunks=slot_chunks,
+                labels_list=feat.QueueEventExtractor.get_labels_list(
+                    fe_kwargs))
@@ -0,0 +1,111 @@
+import multiprocessing as mp
+import pathlib
+
+import numpy as np
+
+from dcnum import feat, read
+
+from helper_methods import retrieve_data
+
+data_path = pathlib.Path(__file__).parent / "data"
+
+
+def get_event_extractor(data, size_thresh_mask):
+    gate = feat.Gate(data, size_thresh_mask=size_thresh_mask)
+    fe_kwargs = feat.QueueEventExtractor.get_init_kwargs(
+        data=data, gate=gate, preselect=False, ptp_median=None,
+        log_queue=mp.Queue())
+    return feat.QueueEventExtractor(*fe_kwargs.values())
+
+
+def test_gate_mask_sums():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        gate = feat.Gate(hd, size_thresh_mask=5)
+        assert np.all(gate.gate_mask_sums(np.array([0, 5, 6, 100]))
+                      == [False, False, True, True])
+        # same result as for the individual masks
+        mask = np.zeros((10, 10), dtype=bool)
+        mask[:2, :3] = True
+        assert gate.gate_mask(mask) == gate.gate_mask_sums(6)
+        assert gate.gate_mask(mask) == gate.gate_mask(None, mask_sum=6)
+
+
+def test_get_masks_from_label():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        qee = get_event_extractor(hd, size_thresh_mask=5)
+        label = np.zeros((20, 30), dtype=np.int16)
+        label[1:3, 1:4] = 1  # area 6
+        label[5:7, 5:7] = 2  # area 4, removed by the gate
+        # there is no label 3
+        label[10:15, 10:15] = 4  # area 25
+        masks = qee.get_masks_from_label(label)
+        assert masks.dtype == bool
+        assert masks.shape == (2, 20, 30)
+        assert np.all(masks[0] == (label == 1))
+        assert np.all(masks[1] == (label == 4))
+
+
+def test_get_masks_from_label_empty():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        qee = get_event_extractor(hd, size_thresh_mask=5)
+        # only background
+        label = np.zeros((20, 30), dtype=np.int16)
+        masks = qee.get_masks_from_label(label)
+        assert masks.dtype == bool
+        assert masks.shape == (0, 20, 30)
+        assert masks.size == 0
+        # all labels removed by the gate
+        label[1:3, 1:3] = 1
+        label[5, 5] = 3
+        masks = qee.get_masks_from_label(label)
+        assert masks.shape == (0, 20, 30)
+
+
+def test_is_duplicate_frame():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        qee = get_event_extractor(hd, size_thresh_mask=5)
+        image = hd.h5["events/image"][:]
+        # not determined yet, the frames are compared
+        assert np.all(np.array(qee.duplicate_frames[:]) == -1)
+        assert not qee.is_duplicate_frame(0)
+        for index in range(1, len(hd)):
+            assert qee.is_duplicate_frame(index) == np.array_equal(
+                image[index - 1], image[index])
+        # the results are stored
+        assert np.all(np.array(qee.duplicate_frames[:]) >= 0)
+        # determined by the manager
+        qee.duplicate_frames[3] = 1
+        assert qee.is_duplicate_frame(3)
+        assert qee.process_label(np.zeros(image.shape[1:], dtype=np.int16),
+                                 index=3) is None
+
+
+def test_get_events_from_masks_box_gates():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        qee = get_event_extractor(hd, size_thresh_mask=5)
+        image_shape = hd.image.image_shape
+        masks = np.zeros((2,) + image_shape, dtype=bool)
+        masks[0, 10:20, 10:20] = True  # area 100
+        masks[1, 30:50, 30:50] = True  # area 400
+        pxa = hd.pixel_size**2
+        qee.gate.box_gates = {"area_um min": 50 * pxa}
+        events = qee.get_events_from_masks(
+            masks=masks, data_index=0, brightness=False, haralick=False)
+        # all events are valid, the arrays are not copied
+        assert events["mask"] is masks
+        assert len(events["area_um"]) == 2
+        qee.gate.box_gates = {"area_um min": 200 * pxa}
+        events = qee.get_events_from_masks(
+            masks=masks, data_index=0, brightness=False, haralick=False)
+        assert len(events["area_um"]) == 1
+        assert np.all(events["mask"][0] == masks[1])
@@ -65,6 +65,94 @@ def test_image_cache_index_out_of_range(tmp_path):
             hic.__getitem__(20)
 
 
+def test_image_cache_boolean(tmp_path):
+    path = tmp_path / "test.hdf5"
+    mask = np.random.randint(0, 2, size=(20, 80, 180), dtype=np.uint8)
+    with h5py.File(path, "w") as hw:
+        hw["events/mask"] = mask
+    with h5py.File(path, "r") as h5:
+        hic = read.HDF5ImageCache(h5["events/mask"],
+                                  chunk_size=8,
+                                  cache_size=2,
+                                  boolean=True)
+        chunk0 = hic.get_chunk(0)
+        assert chunk0.dtype == bool
+        assert np.all(chunk0 == mask[:8].astype(bool))
+        # last chunk is smaller
+        chunk2 = hic.get_chunk(2)
+        assert chunk2.shape == (4, 80, 180)
+        assert np.all(chunk2 == mask[16:].astype(bool))
+        # the read buffer must not affect previously returned chunks
+        assert np.all(chunk0 == mask[:8].astype(bool))
+
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_image_cache_prefetch(tmp_path, prefetch):
+    path = tmp_path / "test.hdf5"
+    image = np.random.randint(0, 255, size=(20, 80, 180), dtype=np.uint8)
+    with h5py.File(path, "w") as hw:
+        hw["events/image"] = image
+    with h5py.File(path, "r") as h5:
+        hic = read.HDF5ImageCache(h5["events/image"],
+                                  chunk_size=8,
+                                  cache_size=2,
+                                  prefetch=prefetch)
+        assert np.all(hic.get_chunk(0) == image[:8])
+        if prefetch:
+            assert hic._prefetched[0] == 1
+        else:
+            assert hic._prefetched is None
+        assert np.all(hic.get_chunk(1) == image[8:16])
+        assert np.all(hic.get_chunk(2) == image[16:])
+        # nothing to prefetch after the last chunk
+        assert hic._prefetched is None
+        assert 1 in hic.cache
+        assert 2 in hic.cache
+        hic.close()
+
+
+def test_image_cache_prefetch_random_access(tmp_path):
+    path = tmp_path / "test.hdf5"
+    image = np.random.randint(0, 255, size=(40, 80, 180), dtype=np.uint8)
+    with h5py.File(path, "w") as hw:
+        hw["events/image"] = image
+    with h5py.File(path, "r") as h5:
+        hic = read.HDF5ImageCache(h5["events/image"],
+                                  chunk_size=8,
+                                  cache_size=2)
+        # disabled by default
+        assert not hic.prefetch
+        hic.prefetch = True
+        # no read-ahead when jumping to a chunk
+        assert np.all(hic.get_chunk(2) == image[16:24])
+        assert hic._prefetched is None
+        # read-ahead when reading sequentially
+        assert np.all(hic.get_chunk(3) == image[24:32])
+        assert hic._prefetched[0] == 4
+        assert np.all(hic.get_chunk(4) == image[32:])
+        hic.close()
+
+
+def test_image_cache_close(tmp_path):
+    path = tmp_path / "test.hdf5"
+    image = np.random.randint(0, 255, size=(1100, 8, 18), dtype=np.uint8)
+    with h5py.File(path, "w") as hw:
+        hw.create_dataset("events/image", data=image, chunks=(100, 8, 18))
+        hw.attrs["experiment:event count"] = 1100
+    h5dat = read.HDF5Data(path)
+    hic = h5dat.image
+    hic.prefetch = True
+    assert hic.num_chunks == 2
+    assert np.all(hic.get_chunk(0) == image[:1000])
+    future = hic._prefetched[1]
+    h5dat.close()
+    # the prefetching was stopped before the file was closed
+    assert future.done()
+    assert hic._prefetched is None
+    assert hic._executor is None
+    assert not h5dat.h5
+
+
 def test_image_chache_get_chunk_size(tmp_path):
     path = tmp_path / "test.hdf5"
     size = 20
@@ -83,6 +171,40 @@ def test_image_chache_get_chunk_size(tmp_path):
             hic.get_chunk_size(3)
 
 
+def test_image_cache_chunk_size_aligned(tmp_path):
+    path = tmp_path / "test.hdf5"
+    with h5py.File(path, "w") as hw:
+        hw.create_dataset("events/image",
+                          data=np.zeros((3000, 8, 18), dtype=np.uint8),
+                          chunks=(64, 8, 18))
+        hw.create_dataset("events/image_bg",
+                          data=np.zeros((3000, 8, 18), dtype=np.uint8),
+                          chunks=(100, 8, 18))
+    with read.HDF5Data(path) as h5dat:
+        # largest multiple of 64 not larger than 1000
+        assert h5dat.image.chunk_size == 960
+        # all caches must have the same chunk size
+        assert h5dat.image_bg.chunk_size == 960
+        assert h5dat.image_corr.chunk_size == 960
+
+
+@pytest.mark.parametrize("ds_chunks, chunk_size", [((64, 8, 18), 960),
+                                                   ((100, 8, 18), 1000),
+                                                   ((300, 8, 18), 900),
+                                                   # chunks too large
+                                                   ((2000, 8, 18), 1000),
+                                                   # not chunked
+                                                   (None, 1000)])
+def test_get_aligned_chunk_size(ds_chunks, chunk_size, tmp_path):
+    path = tmp_path / "test.hdf5"
+    with h5py.File(path, "w") as hw:
+        hw.create_dataset("events/image",
+                          data=np.zeros((3000, 8, 18), dtype=np.uint8),
+                          chunks=ds_chunks)
+        assert read.cache.get_aligned_chunk_size(
+            hw["events/image"], chunk_size=1000) == chunk_size
+
+
 @pytest.mark.parametrize("size, chunks", [(209, 21),
                                           (210, 21),
                                           (211, 22)])
@@ -128,6 +250,18 @@ def test_open_real_data():
         assert "deform" in h5dat
 
 
+def test_image_corr_cache():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as h5dat:
+        image = h5dat.h5["events/image"][:]
+        image_bg = h5dat.h5["events/image_bg"][:]
+        chunk = h5dat.image_corr.get_chunk(0)
+        assert chunk.dtype == np.int16
+        assert np.all(chunk == np.array(image, dtype=int) - image_bg)
+        assert np.all(h5dat.image_corr[3] == chunk[3])
+
+
 def test_pickling_state():
     path = retrieve_data(data_path /
                          "fmt-hdf5_cytoshot_full-features_2023.zip")
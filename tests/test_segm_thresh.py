@@ -137,3 +137,21 @@ def test_segm_thresh_segment_batch_large(worker_type):
     for jj in range(101, 121):
         mask_seg = np.array(labels_seg_2[jj - 101], dtype=bool)
         assert np.all(mask_seg == mask[jj]), f"masks not matching at {jj}"
+
+
+def test_segm_thresh_segment_frame_out():
+    mask = np.zeros((80, 200), dtype=bool)
+    mask[10:71, 100:161] = morphology.disk(30)
+    image = -10 * mask
+
+    sm = segm.segm_thresh.SegmentThresh(thresh=-6,
+                                        kwargs_mask={"closing_disk": 3})
+    # the `out` argument must not be part of the pipeline identifier
+    assert sm.get_ppid() == "thresh:t=-6:cle=1^f=1^clo=3"
+    assert sm.segment_approach_accepts_out()
+
+    out = np.empty(image.shape, dtype=bool)
+    assert np.all(sm.segment_approach(image, out, thresh=-6) == mask)
+    labels = sm.segment_frame(image, out=out)
+    assert np.all(labels == sm.segment_frame(image))
+    assert np.all(np.array(labels, dtype=bool) == mask)
@@ -0,0 +1,45 @@
+import collections
+import multiprocessing as mp
+import pathlib
+
+import numpy as np
+
+from dcnum import read, write
+
+from helper_methods import retrieve_data
+
+data_path = pathlib.Path(__file__).parent / "data"
+
+
+def test_queue_collector_thread_event_lists():
+    path = retrieve_data(data_path /
+                         "fmt-hdf5_cytoshot_full-features_2023.zip")
+    with read.HDF5Data(path) as hd:
+        num_frames = len(hd)
+        event_queue = mp.Queue()
+        writer_dq = collections.deque()
+        feat_nevents = mp.Array("i", num_frames)
+        # one event in each frame, except for the first frame
+        feat_nevents[:] = [0] + [1] * (num_frames - 1)
+        # The extractors send lists of events, not in order.
+        event_queue.put([(ii, {"deform": np.array([ii / 100])})
+                         for ii in range(num_frames // 2, num_frames)])
+        event_queue.put([(0, None)]
+                        + [(ii, {"deform": np.array([ii / 100])})
+                           for ii in range(1, num_frames // 2)])
+        qct = write.QueueCollectorThread(
+            data=hd,
+            event_queue=event_queue,
+            writer_dq=writer_dq,
+            feat_nevents=feat_nevents,
+            write_threshold=num_frames,
+        )
+        qct.run()
+        assert qct.written_frames == num_frames
+        assert qct.written_events == num_frames - 1
+        written = dict(writer_dq)
+        assert np.allclose(written["deform"],
+                           np.arange(1, num_frames) / 100)
+        assert np.all(written["nevents"] == 1)
+        assert written["image"].shape == (num_frames - 1,
+                                          ) + hd.image.image_shape